@@ -1,63 +1,316 @@
-1|from anthropic import AsyncAnthropic
-2|from dotenv import load_dotenv
-3|import os
-4|
-5|load_dotenv()
-6|
-7|class AIService:
-8|    def __init__(self):
-9|        self.api_key = os.environ.get("ANTHROPIC_API_KEY")
-10|        self.client = AsyncAnthropic(api_key=self.api_key)
-11|        self.system_message = """You are an AI development assistant for Repbep, a platform that helps developers build applications using AI agents. You provide guidance on:
-12|- Frontend development (React, Tailwind, JavaScript)
-13|- Backend development (FastAPI, Python, MongoDB)
-14|- Code generation and debugging
-15|- Architecture and best practices
-16|- Integration with third-party APIs
-17|
-18|Be concise, practical, and provide code examples when helpful. Use markdown formatting for code blocks."""
-19|        
-20|        # Store conversation history per session
-21|        self.conversations = {}
-22|    
-23|    async def chat(self, session_id: str, message: str) -> str:
-24|        """Send a message to Claude and get a response"""
-25|        try:
-26|            # Initialize conversation history if doesn't exist
-27|            if session_id not in self.conversations:
-28|                self.conversations[session_id] = []
-29|            
-30|            # Add user message to history
-31|            self.conversations[session_id].append({
-32|                "role": "user",
-33|                "content": message
-34|            })
-35|            
-36|            # Call Claude API
-37|            response = await self.client.messages.create(
-38|                model="claude-sonnet-4-20250514",
-39|                max_tokens=4096,
-40|                system=self.system_message,
-41|                messages=self.conversations[session_id]
-42|            )
-43|            
-44|            # Extract response text
-45|            assistant_message = response.content[0].text
-46|            
-47|            # Add assistant response to history
-48|            self.conversations[session_id].append({
-49|                "role": "assistant",
-50|                "content": assistant_message
-51|            })
-52|            
-53|            return assistant_message
-54|            
-55|        except Exception as e:
-56|            print(f"Error in AI service: {str(e)}")
-57|            return f"I apologize, but I encountered an error processing your request. Please try again. Error: {str(e)}"
-58|    
-59|    def clear_session(self, session_id: str):
-60|        """Clear a chat session from memory"""
-61|        if session_id in self.conversations:
-62|            del self.conversations[session_id]
-63|
\ No newline at end of file
+from anthropic import AsyncAnthropic
+from dotenv import load_dotenv
+from typing import Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+from context_window import ContextWindow
+from history_store import HistoryStore, InMemoryHistoryStore
+from metrics import ANTHROPIC_REQUEST_DURATION, ANTHROPIC_TIME_TO_FIRST_TOKEN, record_tokens, timed
+from response_cache import ResponseCache, response_key
+from resilience import CircuitBreaker, RetryPolicy, call_with_resilience, classify
+from scheduler import FairScheduler
+from tracing import span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Returns (history, complete); an incomplete history is used for the turn but not cached
+HistoryLoader = Callable[[], Awaitable[Tuple[List[dict], bool]]]
+
+# Read version of a history that must not be cached
+UNCACHEABLE = object()
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+class AIService:
+    def __init__(self, history_store: Optional[HistoryStore] = None, response_cache: Optional[ResponseCache] = None):
+        self.api_key = os.environ.get("ANTHROPIC_API_KEY")
+        # Retries are handled by the resilience layer, not the SDK
+        self.retry_policy = RetryPolicy.from_env()
+        self.client = AsyncAnthropic(
+            api_key=self.api_key,
+            max_retries=0,
+            timeout=self.retry_policy.attempt_timeout
+        )
+        self.system_message = """You are an AI development assistant for Repbep, a platform that helps developers build applications using AI agents. You provide guidance on:
+- Frontend development (React, Tailwind, JavaScript)
+- Backend development (FastAPI, Python, MongoDB)
+- Code generation and debugging
+- Architecture and best practices
+- Integration with third-party APIs
+
+Be concise, practical, and provide code examples when helpful. Use markdown formatting for code blocks."""
+        self.model = "claude-sonnet-4-20250514"
+        self.max_tokens = 4096
+        
+        # Bounded store of conversation history per session
+        self.conversations = history_store or InMemoryHistoryStore.from_env()
+        
+        # Keeps prompts under a token budget by summarizing older turns
+        self.context = ContextWindow.from_env(self.client, self.model)
+        
+        # Caps concurrent upstream calls, sharing slots fairly between users
+        self.scheduler = FairScheduler.from_env()
+        
+        # Fails fast while the upstream is down instead of piling up requests
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.environ.get("AI_BREAKER_THRESHOLD", 5)),
+            reset_timeout=float(os.environ.get("AI_BREAKER_RESET", 30))
+        )
+        
+        # Longest gap allowed between streamed events once a stream has started
+        self.stream_idle_timeout = float(os.environ.get("AI_STREAM_IDLE_TIMEOUT", 30))
+        
+        # Optional cache of replies to identical first messages
+        self.response_cache = response_cache
+        
+        # Token usage across all chat calls, including prompt cache activity
+        self.usage = {
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        }
+    
+    def system_prompt(self, summary: Optional[str] = None) -> List[dict]:
+        """System prompt blocks, each marked as a prompt-cache breakpoint.
+
+        The fixed instructions and the rolling summary are separate blocks so
+        the instructions stay cached when the summary is refreshed.
+        """
+        blocks = [{"type": "text", "text": self.system_message, "cache_control": CACHE_CONTROL}]
+        if summary:
+            blocks.append({
+                "type": "text",
+                "text": f"Summary of the earlier part of this conversation:\n{summary}",
+                "cache_control": CACHE_CONTROL
+            })
+        return blocks
+    
+    def cached_messages(self, messages: List[dict]) -> List[dict]:
+        """Mark the end of the prompt as a cache breakpoint.
+
+        Caching the whole prompt means the next turn, which extends it with
+        the reply and a new user message, reads this prefix from the cache
+        instead of reprocessing it. The stored history is left untouched.
+        """
+        if not messages:
+            return messages
+        last = messages[-1]
+        return messages[:-1] + [{
+            "role": last["role"],
+            "content": [{"type": "text", "text": last["content"], "cache_control": CACHE_CONTROL}]
+        }]
+    
+    def record_usage(self, usage, operation: str = "chat"):
+        for key in self.usage:
+            self.usage[key] += getattr(usage, key, None) or 0
+        record_tokens(usage, operation)
+    
+    async def cached_response(self, history: List[dict]):
+        """Return (key, cached reply) for a first turn; (None, None) when not cacheable.
+
+        Only opening messages are cached: with no prior history the prompt is
+        just the fixed system message plus the question.
+        """
+        if self.response_cache is None or len(history) != 1:
+            return None, None
+        key = response_key(self.model, self.system_message, history)
+        try:
+            with span("response_cache"):
+                return key, await self.response_cache.get(key)
+        except Exception as e:
+            logger.error(f"Error reading response cache: {e}")
+            return key, None
+    
+    async def store_response(self, key: Optional[str], response: str):
+        if key is None:
+            return
+        try:
+            await self.response_cache.set(key, response)
+        except Exception as e:
+            logger.error(f"Error writing response cache: {e}")
+    
+    async def get_history(self, session_id: str, load_history: Optional[HistoryLoader] = None, version=None):
+        """Return (history, read version), rebuilding the history with `load_history` if it is not cached.
+
+        `version` is the conversation's current `lastModified`; a cached
+        history stored under a different version is reloaded. The read
+        version is the cache entry's version before the read (a stale one,
+        or None, when the history was reloaded); storing the turn's
+        history is conditional on it. A reload the loader reports as
+        incomplete (another worker's turn is not persisted yet) gets the
+        read version UNCACHEABLE.
+        """
+        read_version = self.conversations.version(session_id)
+        history = self.conversations.get(session_id, version)
+        if history is None:
+            history, complete = [], True
+            if load_history:
+                with span("history"):
+                    history, complete = await load_history()
+                history = list(history)
+            if not complete:
+                read_version = UNCACHEABLE
+        return history, read_version
+
+    def store_history(self, session_id: str, history: List[dict], next_version, read_version):
+        if read_version is UNCACHEABLE:
+            # Caching it would serve the missing turn's absence as current;
+            # dropping the entry also fails any concurrent compare-and-set
+            self.conversations.delete(session_id)
+            return
+        self.conversations.set(session_id, history, next_version, expected=read_version)
+    
+    async def chat(
+        self,
+        session_id: str,
+        message: str,
+        load_history: Optional[HistoryLoader] = None,
+        version=None,
+        next_version=None,
+        user_id: Optional[str] = None
+    ) -> str:
+        """Send a message to Claude and get a response.
+
+        The updated history is cached under `next_version`, the `lastModified`
+        the caller will store on the conversation for this turn, unless a
+        concurrent turn on the conversation stored its own meanwhile. Upstream
+        calls are queued per `user_id` by the scheduler; SchedulerTimeout is
+        raised if no slot frees up in time. Upstream failures raise
+        AIServiceError and leave the history unchanged. A first message may
+        be answered from the response cache without calling Claude.
+        """
+        history, read_version = await self.get_history(session_id, load_history, version)
+        
+        # Add user message to history
+        history.append({
+            "role": "user",
+            "content": message
+        })
+        
+        cache_key, assistant_message = await self.cached_response(history)
+        if assistant_message is not None:
+            history.append({"role": "assistant", "content": assistant_message})
+            self.store_history(session_id, history, next_version, read_version)
+            return assistant_message
+        
+        async with self.scheduler.slot(user_id or session_id):
+            # Older turns beyond the token budget are replaced by a summary
+            with span("context"):
+                summary, messages = await self.context.build(session_id, history)
+            
+            # Call Claude API, retrying transient failures
+            with timed(ANTHROPIC_REQUEST_DURATION, operation="chat"), span("claude"):
+                response = await call_with_resilience(
+                    lambda: self.client.messages.create(
+                        model=self.model,
+                        max_tokens=self.max_tokens,
+                        system=self.system_prompt(summary),
+                        messages=self.cached_messages(messages)
+                    ),
+                    self.retry_policy,
+                    self.breaker
+                )
+        self.record_usage(response.usage)
+        
+        # Extract response text
+        assistant_message = "".join(block.text for block in response.content if block.type == "text")
+        await self.store_response(cache_key, assistant_message)
+        
+        # Add assistant response to history
+        history.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+        self.store_history(session_id, history, next_version, read_version)
+        
+        return assistant_message
+    
+    async def chat_stream(
+        self,
+        session_id: str,
+        message: str,
+        load_history: Optional[HistoryLoader] = None,
+        version=None,
+        next_version=None,
+        user_id: Optional[str] = None
+    ):
+        """Send a message to Claude and yield the response text as it is generated.
+
+        The turn is only added to the session history once the stream
+        completes. If the consumer stops iterating (e.g. the client
+        disconnected), the upstream request is closed so generation stops.
+        The scheduler slot is held for the whole stream. Opening the stream
+        is retried like `chat`; a failure or a stall longer than
+        `stream_idle_timeout` after that raises AIServiceError.
+        """
+        history, read_version = await self.get_history(session_id, load_history, version)
+        history.append({"role": "user", "content": message})
+
+        cache_key, cached = await self.cached_response(history)
+        if cached is not None:
+            yield cached
+            history.append({"role": "assistant", "content": cached})
+            self.store_history(session_id, history, next_version, read_version)
+            return
+
+        async with self.scheduler.slot(user_id or session_id):
+            with span("context"):
+                summary, messages = await self.context.build(session_id, history)
+            with timed(ANTHROPIC_REQUEST_DURATION, operation="stream"), span("claude"):
+                started = time.perf_counter()
+                stream = await call_with_resilience(
+                    lambda: self.client.messages.create(
+                        model=self.model,
+                        max_tokens=self.max_tokens,
+                        system=self.system_prompt(summary),
+                        messages=self.cached_messages(messages),
+                        stream=True
+                    ),
+                    self.retry_policy,
+                    self.breaker
+                )
+                parts = []
+                usage = None
+                try:
+                    events = stream.__aiter__()
+                    while True:
+                        try:
+                            event = await asyncio.wait_for(events.__anext__(), self.stream_idle_timeout)
+                        except StopAsyncIteration:
+                            break
+                        if event.type == "message_start":
+                            usage = event.message.usage
+                        elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                            if not parts:
+                                ANTHROPIC_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started)
+                            parts.append(event.delta.text)
+                            yield event.delta.text
+                        elif event.type == "message_delta" and usage is not None:
+                            # Output tokens are only final in the closing delta
+                            usage.output_tokens = event.usage.output_tokens
+                except Exception as e:
+                    self.breaker.record_failure()
+                    raise classify(e) from e
+                finally:
+                    await stream.close()
+        if usage is not None:
+            self.record_usage(usage, "stream")
+        assistant_message = "".join(parts)
+        await self.store_response(cache_key, assistant_message)
+
+        history.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+        self.store_history(session_id, history, next_version, read_version)
+
+    def clear_session(self, session_id: str):
+        """Clear a chat session from memory"""
+        self.conversations.delete(session_id)
+        self.context.forget(session_id)
@@ -1,10 +1,19 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import asyncio
+import hashlib
 import os
+import threading
+import time
+
+from metrics import BCRYPT_WAIT
+from tracing import span
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
@@ -13,11 +22,70 @@ JWT_SECRET = os.environ.get("JWT_SECRET", "default_secret_key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+class BcryptPool:
+    """Runs bcrypt in a bounded thread pool so hashing never blocks the event loop.
+
+    At most `max_workers` hashes run at once; further calls queue, and the
+    time they spend waiting for a worker is recorded (bcrypt_pool_wait_seconds).
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waiting = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def run(self, fn, *args):
+        submitted = time.perf_counter()
+        queued = True
+        with self._lock:
+            self.waiting += 1
+
+        def dequeue():
+            # Under the lock; whichever of the job and the caller gets here first counts it
+            nonlocal queued
+            if queued:
+                queued = False
+                self.waiting -= 1
+
+        def job():
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                dequeue()
+                self.calls += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            BCRYPT_WAIT.observe(waited)
+            return fn(*args)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+        try:
+            with span("bcrypt"):
+                return await asyncio.get_running_loop().run_in_executor(self.executor, job)
+        finally:
+            # A caller cancelled while its job was still queued: the job never runs
+            with self._lock:
+                dequeue()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "calls": self.calls,
+                "waiting": self.waiting,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+bcrypt_pool = BcryptPool(int(os.environ.get("BCRYPT_CONCURRENCY", 4)))
+
+async def hash_password(password: str) -> str:
+    return await bcrypt_pool.run(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await bcrypt_pool.run(pwd_context.verify, plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -26,9 +94,54 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
+    with span("jwt"):
+        encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
     return encoded_jwt
 
+class TokenCache:
+    """Bounded LRU cache of already verified tokens.
+
+    Entries are keyed by a SHA-256 digest of the token, hold the token's
+    `sub`, and are dropped once the token's `exp` has passed. Only tokens
+    that passed `decode_token` are ever inserted.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[str]:
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        user_id, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user_id
+
+    def put(self, token: str, user_id: str, expires_at: float):
+        key = hashlib.sha256(token.encode()).digest()
+        self._entries[key] = (user_id, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+token_cache = TokenCache(int(os.environ.get("JWT_CACHE_SIZE", 10000)))
+
 def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
@@ -36,10 +149,23 @@ def decode_token(token: str) -> dict:
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
-    token = credentials.credentials
+def user_id_from_token(token: str) -> str:
+    """Resolve a bearer token to its user id, checking the verification cache first"""
+    with span("jwt"):
+        return _user_id_from_token(token)
+
+def _user_id_from_token(token: str) -> str:
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    
     payload = decode_token(token)
     user_id = payload.get("sub")
     if user_id is None:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    if payload.get("exp") is not None:
+        token_cache.put(token, user_id, payload["exp"])
     return user_id
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
+    return user_id_from_token(credentials.credentials)
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the backend.
+
+Runs the FastAPI app in-process (httpx ASGITransport) against two local
+stand-ins, so it needs no network access:
+- MongoDB: an existing server (--mongo-url), a throwaway mongod started in a
+  temp directory, or an in-memory fake (mongomock_motor, if installed)
+- Anthropic: a fake /v1/messages server on localhost with configurable
+  time-to-first-token and token rate, reached through ANTHROPIC_BASE_URL
+
+Seeds users, projects and conversations with long histories, then drives a
+weighted mix of workloads (login storms, chat and streamed chat on long
+histories, conversation listing, message pages, project lists) from
+--concurrency workers and reports p50/p95/p99 latency and requests per
+second per endpoint.
+
+Rate limits and load shedding are disabled unless --admission is given.
+The in-memory fake cannot run the $lookup sub-pipelines behind conversation
+listing, so the list and summary workloads need a real mongod; with the fake
+they are left out of the default mix. Failed requests are counted as errors
+but kept out of the latency percentiles.
+
+Usage: python benchmarks/load_test.py [--mongo auto|mongod|memory] [--mongo-url URL]
+           [--concurrency 20] [--duration 20] [--mix chat=4,list=2,login=1]
+           [--ai-latency 0.5] [--ai-token-rate 200] [--ai-tokens 200]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+PASSWORD = "benchmark-password"
+
+DEFAULT_MIX = "login=1,chat=3,stream=1,list=2,summary=2,messages=1,projects=2"
+
+# Workloads the in-memory fake cannot serve ($lookup with a sub-pipeline)
+NEEDS_MONGOD = {"list", "summary"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ============= FAKE ANTHROPIC =============
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def fake_anthropic_app(latency: float, token_rate: float, tokens: int) -> Starlette:
+    """A /v1/messages stand-in: waits `latency`, then emits `tokens` at `token_rate` per second"""
+
+    async def messages(request: Request):
+        body = await request.json()
+        input_tokens = len(json.dumps(body)) // 4
+        words = [f"token{i} " for i in range(tokens)]
+        message_id = f"msg_bench_{random.getrandbits(48):012x}"
+
+        if body.get("stream"):
+            async def events():
+                yield sse("message_start", {"type": "message_start", "message": {
+                    "id": message_id, "type": "message", "role": "assistant", "model": body["model"],
+                    "content": [], "stop_reason": None, "stop_sequence": None,
+                    "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+                }})
+                await asyncio.sleep(latency)
+                yield sse("content_block_start", {
+                    "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}
+                })
+                for word in words:
+                    await asyncio.sleep(1 / token_rate)
+                    yield sse("content_block_delta", {
+                        "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word}
+                    })
+                yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+                yield sse("message_delta", {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": tokens},
+                })
+                yield sse("message_stop", {"type": "message_stop"})
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + tokens / token_rate)
+        return JSONResponse({
+            "id": message_id, "type": "message", "role": "assistant", "model": body["model"],
+            "content": [{"type": "text", "text": "".join(words)}],
+            "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": tokens},
+        })
+
+    return Starlette(routes=[Route("/v1/messages", messages, methods=["POST"])])
+
+
+class FakeAnthropicServer:
+    """Serves the fake API with uvicorn on its own thread and event loop"""
+
+    def __init__(self, app: Starlette):
+        self.port = free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake Anthropic server did not start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+# ============= MONGO =============
+
+def start_mongod(binary: str) -> Tuple[str, Callable[[], None]]:
+    """Start a throwaway mongod in a temp directory; returns (url, cleanup)"""
+    from pymongo import MongoClient
+
+    dbpath = tempfile.mkdtemp(prefix="repbep-bench-")
+    port = free_port()
+    proc = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"mongodb://127.0.0.1:{port}"
+
+    def cleanup():
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            MongoClient(url, serverSelectionTimeoutMS=500).admin.command("ping")
+            return url, cleanup
+        except Exception:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                cleanup()
+                raise RuntimeError(f"mongod failed to start on port {port}")
+            time.sleep(0.2)
+
+
+def use_memory_mongo():
+    """Point the database module at an in-memory fake before the app imports it"""
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("--mongo memory needs mongomock_motor (pip install mongomock-motor)")
+    import database
+
+    fake = AsyncMongoMockClient()
+    database.client = fake
+    database.db = fake[database.db_name]
+    for name in dir(database):
+        if name.endswith("_collection"):
+            setattr(database, name, database.db[getattr(database, name).name])
+
+
+# ============= SEEDING =============
+
+class BenchUser:
+    __slots__ = ("email", "headers", "conversation_id", "sent")
+
+    def __init__(self, email: str, headers: dict, conversation_id: str):
+        self.email = email
+        self.headers = headers
+        self.conversation_id = conversation_id
+        self.sent = 0
+
+
+async def seed(args) -> List[BenchUser]:
+    """Insert users, projects and conversations directly, bypassing the API"""
+    from bson import ObjectId
+    import auth
+    import database
+
+    password_hash = await auth.hash_password(PASSWORD)
+    now = datetime.utcnow()
+    users = []
+    for i in range(args.users):
+        user_id = ObjectId()
+        email = f"bench{i}@example.com"
+        await database.users_collection.insert_one({
+            "_id": user_id,
+            "email": email,
+            "password": password_hash,
+            "displayName": f"Bench {i}",
+            "avatar": "",
+            "bio": "",
+            "theme": "dark",
+            "colorScheme": "emerald",
+            "socialLinks": {"github": "", "twitter": "", "linkedin": ""},
+            "workspaceSettings": {"autoSave": True, "codeCompletion": True, "notifications": True},
+            "createdAt": now,
+        })
+        if args.projects:
+            await database.projects_collection.insert_many([{
+                "userId": user_id,
+                "name": f"Project {p}",
+                "description": "Seeded for the load test",
+                "status": "active",
+                "tech": ["React", "FastAPI", "MongoDB"],
+                "color": "emerald",
+                "createdAt": now - timedelta(days=p),
+                "lastModified": now - timedelta(hours=p),
+            } for p in range(args.projects)])
+
+        conversation_ids = []
+        for c in range(args.conversations):
+            started = now - timedelta(days=c + 1)
+            conversation = {
+                "_id": ObjectId(),
+                "userId": user_id,
+                "projectId": None,
+                "title": f"Conversation {c}",
+                "sessionId": f"session_bench_{user_id}_{c}",
+                "createdAt": started,
+                "lastModified": started + timedelta(seconds=args.messages),
+            }
+            await database.conversations_collection.insert_one(conversation)
+            conversation_ids.append(str(conversation["_id"]))
+            if args.messages:
+                await database.messages_collection.insert_many([{
+                    "conversationId": conversation["_id"],
+                    "role": "user" if m % 2 == 0 else "assistant",
+                    "content": f"Seeded message {m}. " + "How should I index this collection? " * 8,
+                    "timestamp": started + timedelta(seconds=m),
+                } for m in range(args.messages)])
+
+        token = auth.create_access_token({"sub": str(user_id)})
+        users.append(BenchUser(email, {"Authorization": f"Bearer {token}"}, conversation_ids[0] if conversation_ids else None))
+    return users
+
+
+# ============= WORKLOADS =============
+
+# name -> (endpoint label, request builder)
+def workloads() -> Dict[str, Tuple[str, Callable]]:
+    def login(user):
+        return "POST", "/api/auth/login", {"json": {"email": user.email, "password": PASSWORD}}
+
+    def chat(user):
+        user.sent += 1
+        body = {"message": f"Load test question {user.sent}", "conversationId": user.conversation_id}
+        return "POST", "/api/chat/message", {"json": body, "headers": user.headers}
+
+    def stream(user):
+        user.sent += 1
+        body = {"message": f"Load test streamed question {user.sent}", "conversationId": user.conversation_id}
+        return "POST", "/api/chat/message/stream", {"json": body, "headers": user.headers}
+
+    def conversations(view):
+        def build(user):
+            return "GET", "/api/chat/conversations", {"params": {"view": view}, "headers": user.headers}
+        return build
+
+    def messages(user):
+        path = f"/api/chat/conversations/{user.conversation_id}/messages"
+        return "GET", path, {"params": {"limit": 100}, "headers": user.headers}
+
+    def projects(user):
+        return "GET", "/api/projects", {"headers": user.headers}
+
+    return {
+        "login": ("POST /api/auth/login", login),
+        "chat": ("POST /api/chat/message", chat),
+        "stream": ("POST /api/chat/message/stream", stream),
+        "list": ("GET /api/chat/conversations?view=full", conversations("full")),
+        "summary": ("GET /api/chat/conversations?view=summary", conversations("summary")),
+        "messages": ("GET /api/chat/conversations/{id}/messages", messages),
+        "projects": ("GET /api/projects", projects),
+    }
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    available = workloads()
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in available:
+            raise SystemExit(f"Unknown workload {name!r}; choose from {', '.join(available)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Results:
+    """Per-endpoint request counts, error kinds and latencies of successful requests"""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, label: str, seconds: float, status: Optional[int], error: Optional[str] = None):
+        self.counts[label] += 1
+        if error or status is None or status >= 400:
+            # A fast failure would otherwise pull the percentiles down
+            self.errors[label][error or str(status)] += 1
+        else:
+            self.latencies[label].append(seconds)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+async def worker(client: httpx.AsyncClient, users: List[BenchUser], mix: Dict[str, float],
+                 results: Results, stop_at: float, remaining: Optional[List[int]]):
+    available = workloads()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < stop_at:
+        if remaining is not None:
+            if remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+        label, build = available[random.choices(names, weights)[0]]
+        method, path, kwargs = build(random.choice(users))
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            status = response.status_code
+            error = "stream error" if b"event: error" in response.content else None
+        except Exception as e:
+            status, error = None, type(e).__name__
+        results.record(label, time.perf_counter() - started, status, error)
+
+
+def report(results: Results, elapsed: float) -> dict:
+    summary = {}
+    header = f"{'endpoint':<46} {'count':>7} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    total = 0
+    for label in sorted(results.counts):
+        count = results.counts[label]
+        values = sorted(results.latencies.get(label, []))
+        kinds = dict(results.errors.get(label, {}))
+        errors = sum(kinds.values())
+        total += count
+        row = {
+            "count": count,
+            "errors": errors,
+            "error_kinds": kinds,
+            "rps": count / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000 if values else 0.0,
+        }
+        summary[label] = row
+        print(f"{label:<46} {row['count']:>7} {errors:>7} {row['rps']:>8.1f} {row['p50_ms']:>9.1f} "
+              f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    print("-" * len(header))
+    print(f"{'total':<46} {total:>7} {'':>7} {total / elapsed:>8.1f}   over {elapsed:.1f}s")
+    for label, kinds in results.errors.items():
+        print(f"  errors for {label}: {dict(kinds)}")
+    return summary
+
+
+# ============= MAIN =============
+
+def configure_environment(args, anthropic_url: str, mongo_url: Optional[str]):
+    """Set the app's environment before anything imports server/database"""
+    os.environ["ANTHROPIC_BASE_URL"] = anthropic_url
+    os.environ["ANTHROPIC_API_KEY"] = "bench-key"
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["MONGO_URL"] = mongo_url or "mongodb://127.0.0.1:1"
+    if not args.admission:
+        for group in ("AUTH", "CHAT", "CRUD"):
+            for scope in ("USER", "IP"):
+                os.environ[f"RATE_LIMIT_{group}_{scope}"] = "off"
+        os.environ["SHED_MAX_IN_FLIGHT"] = str(10 ** 9)
+        os.environ["SHED_MAX_LOOP_LAG"] = str(10 ** 9)
+
+
+async def run(args, mix: Dict[str, float]) -> dict:
+    import database
+    import server
+
+    # The app configures INFO logging; keep per-request HTTP client logs out of the report
+    logging.getLogger().setLevel(logging.WARNING)
+    await database.ensure_indexes()
+    print(f"Seeding {args.users} users x {args.conversations} conversations x {args.messages} messages ...")
+    users = await seed(args)
+
+    results = Results()
+    transport = httpx.ASGITransport(app=server.app)
+    limits = None if args.requests is None else [args.requests]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"Running {', '.join(f'{k}={v:g}' for k, v in mix.items())} with {args.concurrency} workers ...")
+        started = time.monotonic()
+        stop_at = started + args.duration
+        await asyncio.gather(*(
+            worker(client, users, mix, results, stop_at, limits) for _ in range(args.concurrency)
+        ))
+        elapsed = time.monotonic() - started
+
+    await server.write_behind.stop()
+    await server.load_shedder.stop()
+    if not args.keep_db and args.mongo != "memory":
+        await database.client.drop_database(args.db_name)
+    print()
+    return report(results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", choices=["auto", "mongod", "memory"], default="auto",
+                        help="auto uses mongod from PATH if present, else the in-memory fake")
+    parser.add_argument("--mongo-url", help="use an existing MongoDB instead of starting one")
+    parser.add_argument("--mongod", default="mongod", help="mongod binary to start")
+    parser.add_argument("--db-name", default=f"repbep_bench_{os.getpid()}")
+    parser.add_argument("--keep-db", action="store_true", help="keep the seeded database afterwards")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--projects", type=int, default=20, help="projects per user")
+    parser.add_argument("--conversations", type=int, default=10, help="conversations per user")
+    parser.add_argument("--messages", type=int, default=100, help="messages per conversation")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted workloads (default {DEFAULT_MIX})")
+    parser.add_argument("--ai-latency", type=float, default=0.5, help="fake time to first token, seconds")
+    parser.add_argument("--ai-token-rate", type=float, default=200, help="fake output tokens per second")
+    parser.add_argument("--ai-tokens", type=int, default=200, help="fake output tokens per reply")
+    parser.add_argument("--admission", action="store_true", help="keep rate limits and load shedding on")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    cleanups = []
+    mongo_url = args.mongo_url
+    if mongo_url:
+        args.mongo = "url"
+    elif args.mongo == "auto":
+        args.mongo = "mongod" if shutil.which(args.mongod) else "memory"
+    if args.mongo == "mongod":
+        mongo_url, cleanup = start_mongod(args.mongod)
+        cleanups.append(cleanup)
+    mix = parse_mix(args.mix)
+    if args.mongo == "memory" and NEEDS_MONGOD & set(mix):
+        if args.mix == DEFAULT_MIX:
+            mix = {name: weight for name, weight in mix.items() if name not in NEEDS_MONGOD}
+            print("Note: the in-memory fake does not support $lookup sub-pipelines; "
+                  "leaving list/summary out (use --mongo mongod or --mongo-url to include them)")
+        else:
+            print("Note: the in-memory fake does not support $lookup sub-pipelines; list/summary will report errors")
+
+    fake = FakeAnthropicServer(fake_anthropic_app(args.ai_latency, args.ai_token_rate, args.ai_tokens))
+    fake.start()
+    cleanups.append(fake.stop)
+    try:
+        configure_environment(args, fake.url, mongo_url)
+        if args.mongo == "memory":
+            use_memory_mongo()
+        summary = asyncio.run(run(args, mix))
+        if args.json:
+            Path(args.json).write_text(json.dumps(summary, indent=2))
+    finally:
+        for cleanup in reversed(cleanups):
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
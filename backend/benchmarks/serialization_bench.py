@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for response serialization.
+
+Compares the per-response CPU cost of the previous path (mutating
+serialize_doc, response_model validation, jsonable_encoder and the stdlib
+JSON encoder) against serialization.serialize + orjson for the project
+list and the full conversation list.
+
+Usage: python benchmarks/serialization_bench.py [--conversations 20] [--messages 200]
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import ProjectResponse  # noqa: E402
+from serialization import dumps, serialize  # noqa: E402
+
+
+def serialize_doc(doc):
+    """The helper server.py used before the serialization module"""
+    if doc and "_id" in doc:
+        doc["id"] = str(doc["_id"])
+        del doc["_id"]
+    return doc
+
+
+def make_projects(count: int) -> List[dict]:
+    now = datetime.utcnow()
+    return [{
+        "_id": ObjectId(),
+        "name": f"Project {i}",
+        "description": "A project used to benchmark response serialization",
+        "status": "active",
+        "tech": ["React", "FastAPI", "MongoDB"],
+        "color": "emerald",
+        "createdAt": now - timedelta(days=i),
+        "lastModified": now - timedelta(hours=i),
+    } for i in range(count)]
+
+
+def make_conversations(count: int, messages: int) -> List[dict]:
+    now = datetime.utcnow()
+    return [{
+        "_id": ObjectId(),
+        "projectId": ObjectId(),
+        "title": f"Conversation {i}",
+        "createdAt": now,
+        "lastModified": now,
+        "messages": [{
+            "_id": ObjectId(),
+            "role": "user" if j % 2 == 0 else "assistant",
+            "content": "How do I add an index to this collection? " * 8,
+            "timestamp": now + timedelta(seconds=j),
+        } for j in range(messages)],
+    } for i in range(count)]
+
+
+def copy_docs(docs: List[dict]) -> List[dict]:
+    # The old path mutates documents, so each run needs fresh ones
+    return [
+        {**doc, "messages": [dict(m) for m in doc["messages"]]} if "messages" in doc else dict(doc)
+        for doc in docs
+    ]
+
+
+projects_adapter = TypeAdapter(List[ProjectResponse])
+
+
+def projects_before(docs):
+    content = [serialize_doc(doc) for doc in docs]
+    validated = projects_adapter.validate_python(content)
+    return json.dumps(jsonable_encoder(projects_adapter.dump_python(validated, mode="json"))).encode()
+
+
+def projects_after(docs):
+    return dumps(serialize(docs))
+
+
+def conversations_before(docs):
+    result = []
+    for conv in docs:
+        conv = serialize_doc(conv)
+        conv["projectId"] = str(conv["projectId"])
+        conv["messages"] = [serialize_doc(msg) for msg in conv["messages"]]
+        result.append(conv)
+    return json.dumps(jsonable_encoder(result)).encode()
+
+
+def conversations_after(docs):
+    return dumps(serialize(docs))
+
+
+def bench(label: str, fn, make_docs, number: int):
+    per_call = min(timeit.repeat(
+        "fn(docs)",
+        setup="docs = make_docs()",
+        globals={"fn": fn, "make_docs": make_docs},
+        number=1,
+        repeat=number,
+    ))
+    print(f"  {label:<8} {per_call * 1000:9.3f} ms/response")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    projects = make_projects(args.projects)
+    conversations = make_conversations(args.conversations, args.messages)
+
+    # Both paths must produce the same JSON
+    assert json.loads(projects_before(copy_docs(projects))) == json.loads(projects_after(projects))
+    assert json.loads(conversations_before(copy_docs(conversations))) == json.loads(conversations_after(conversations))
+
+    print(f"GET /api/projects ({args.projects} projects)")
+    before = bench("before", projects_before, lambda: copy_docs(projects), args.repeat)
+    after = bench("after", projects_after, lambda: projects, args.repeat)
+    print(f"  speedup  {before / after:9.1f}x")
+
+    print(f"GET /api/chat/conversations ({args.conversations} x {args.messages} messages)")
+    before = bench("before", conversations_before, lambda: copy_docs(conversations), args.repeat)
+    after = bench("after", conversations_after, lambda: conversations, args.repeat)
+    print(f"  speedup  {before / after:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
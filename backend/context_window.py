@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import hashlib
+import logging
+import os
+
+from metrics import ANTHROPIC_REQUEST_DURATION, record_tokens, timed
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a developer and an AI development assistant. Merge the new messages into the existing summary. Keep decisions, requirements, code names, file names, errors and open questions; drop pleasantries. Reply with the updated summary only."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for budgeting"""
+    return len(text) // 4 + 1
+
+
+def history_tokens(messages: List[dict]) -> int:
+    return sum(estimate_tokens(m["content"]) + 4 for m in messages)
+
+
+def _fingerprint(message: dict) -> str:
+    return hashlib.sha1(f'{message["role"]}:{message["content"]}'.encode("utf-8")).hexdigest()
+
+
+class ContextWindow:
+    """Keeps the prompt for a session under a token budget.
+
+    While a conversation fits in `max_tokens` it is sent verbatim. Once it
+    does not, everything but the last `keep_turns` turns is folded into a
+    summary that is cached per session and only extended with the messages
+    that fell out of the window since the previous fold, so each turn costs
+    at most one incremental summarization call.
+    """
+
+    def __init__(self, client, model: str, max_tokens: int = 32000, keep_turns: int = 6,
+                 summary_max_tokens: int = 1024, max_sessions: int = 1000):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.max_sessions = max_sessions
+        # session_id -> (summary, number of history messages it covers,
+        # fingerprint of the last covered message)
+        self._summaries: "OrderedDict[str, Tuple[str, int, str]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls, client, model: str) -> "ContextWindow":
+        return cls(
+            client,
+            model=os.environ.get("CONTEXT_SUMMARY_MODEL", model),
+            max_tokens=int(os.environ.get("CONTEXT_MAX_TOKENS", 32000)),
+            keep_turns=int(os.environ.get("CONTEXT_KEEP_TURNS", 6)),
+            summary_max_tokens=int(os.environ.get("CONTEXT_SUMMARY_MAX_TOKENS", 1024)),
+        )
+
+    async def build(self, session_id: str, history: List[dict]) -> Tuple[Optional[str], List[dict]]:
+        """Return (summary, messages) to send for `history`.
+
+        `history` ends with the new user message. `summary` is None while the
+        whole history fits in the budget.
+        """
+        summary, covered = self._cached_summary(session_id, history)
+        tail = history[covered:]
+        if history_tokens(tail) + (estimate_tokens(summary) if summary else 0) <= self.max_tokens:
+            return summary, tail
+
+        cut = self._fold_point(tail)
+        if cut == 0:
+            return summary, tail
+
+        try:
+            summary = await self._summarize(summary, tail[:cut])
+        except Exception as e:
+            # Without a fresh summary, drop the oldest turns rather than
+            # sending a prompt that is over budget
+            logger.error(f"Error summarizing conversation context: {e}")
+            return summary, tail[cut:]
+
+        covered += cut
+        self._summaries[session_id] = (summary, covered, _fingerprint(history[covered - 1]))
+        self._summaries.move_to_end(session_id)
+        while len(self._summaries) > self.max_sessions:
+            self._summaries.popitem(last=False)
+        return summary, tail[cut:]
+
+    def forget(self, session_id: str):
+        self._summaries.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def _cached_summary(self, session_id: str, history: List[dict]) -> Tuple[Optional[str], int]:
+        cached = self._summaries.get(session_id)
+        if cached is None:
+            return None, 0
+        summary, covered, fingerprint = cached
+        # A history rebuilt from a different window of stored messages no
+        # longer lines up with the summary, so start over
+        if covered >= len(history) or _fingerprint(history[covered - 1]) != fingerprint:
+            del self._summaries[session_id]
+            return None, 0
+        self._summaries.move_to_end(session_id)
+        return summary, covered
+
+    def _fold_point(self, messages: List[dict]) -> int:
+        """Index of the user message from which the tail is kept verbatim.
+
+        Keeps the last `keep_turns` turns, or fewer if they alone would not
+        leave room for the summary within the budget.
+        """
+        turn_starts = [i for i, m in enumerate(messages) if m["role"] == "user"]
+        if not turn_starts:
+            return 0
+        candidates = turn_starts[-self.keep_turns:] if self.keep_turns > 0 else turn_starts[-1:]
+        budget = self.max_tokens - self.summary_max_tokens
+        for start in candidates:
+            if history_tokens(messages[start:]) <= budget:
+                return start
+        return candidates[-1]
+
+    async def _summarize(self, summary: Optional[str], messages: List[dict]) -> str:
+        transcript = "\n\n".join(f'{m["role"].upper()}: {m["content"]}' for m in messages)
+        prompt = f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"
+        with timed(ANTHROPIC_REQUEST_DURATION, operation="summary"):
+            response = await self.client.messages.create(
+                model=self.model,
+                max_tokens=self.summary_max_tokens,
+                system=SUMMARY_PROMPT,
+                messages=[{"role": "user", "content": prompt}]
+            )
+        record_tokens(response.usage, "summary")
+        return response.content[0].text
@@ -1,10 +1,17 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+import logging
 import os
 
+from metrics import MongoCommandMetrics
+
+logger = logging.getLogger(__name__)
+
 mongo_url = os.environ.get('MONGO_URL')
 db_name = os.environ.get('DB_NAME', 'repbep')
 
-client = AsyncIOMotorClient(mongo_url)
+# Every command is timed per collection and operation for /metrics
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[db_name]
 
 # Collections
@@ -12,3 +19,68 @@ users_collection = db.users
 projects_collection = db.projects
 conversations_collection = db.conversations
 messages_collection = db.messages
+response_cache_collection = db.response_cache
+rate_limits_collection = db.rate_limits
+
+# Indexes for every query shape in server.py: (keys, options) per collection name
+INDEXES = {
+    "users": [
+        # Login/register look users up by email
+        ([("email", 1)], {"unique": True}),
+    ],
+    "projects": [
+        # Project pages are keyset-ordered by (lastModified, _id)
+        ([("userId", 1), ("lastModified", -1), ("_id", -1)], {}),
+    ],
+    "conversations": [
+        # Conversation pages, overall and per project
+        ([("userId", 1), ("lastModified", -1), ("_id", -1)], {}),
+        ([("userId", 1), ("projectId", 1), ("lastModified", -1), ("_id", -1)], {}),
+        # Chat search over titles
+        ([("userId", 1), ("title", "text")], {}),
+    ],
+    "messages": [
+        # Context rebuilds, message pages and the conversation $lookup
+        ([("conversationId", 1), ("timestamp", 1), ("_id", 1)], {}),
+        # Chat search (search.MongoSearchIndex), scoped by the denormalized userId
+        ([("userId", 1), ("content", "text")], {}),
+    ],
+    "response_cache": [
+        # Mongo-backed AI response cache entries expire at expiresAt
+        ([("expiresAt", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "rate_limits": [
+        # Idle Mongo-backed rate limit buckets expire at expiresAt
+        ([("expiresAt", 1)], {"expireAfterSeconds": 0}),
+    ],
+}
+
+def index_keys(info: dict) -> list:
+    """Key spec of an existing index as declared in INDEXES.
+
+    Text indexes are reported as `_fts`/`_ftsx` pseudo-fields; they are
+    mapped back to ("field", "text") pairs.
+    """
+    keys = []
+    for field, direction in info["key"]:
+        if field == "_fts":
+            keys.extend((name, "text") for name in sorted(info["weights"]))
+        elif field != "_ftsx":
+            keys.append((field, direction))
+    return keys
+
+async def ensure_indexes():
+    """Create any missing indexes from INDEXES, logging what was created or already present"""
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = [index_keys(info) for info in (await collection.index_information()).values()]
+        for keys, options in indexes:
+            if [tuple(field) for field in keys] in existing:
+                logger.info(f"Index on {collection.name} {keys} already exists")
+                continue
+            try:
+                name = await collection.create_index(keys, **options)
+                logger.info(f"Created index {name} on {collection.name}")
+            except OperationFailure as e:
+                # e.g. duplicate emails blocking the unique index; keep serving
+                logger.error(f"Failed to create index on {collection.name} {keys}: {e}")
@@ -0,0 +1,105 @@
+from bson import ObjectId
+from datetime import datetime
+from typing import AsyncIterator, Dict
+import logging
+import zlib
+
+from serialization import dumps, serialize
+
+logger = logging.getLogger(__name__)
+
+# Export format version, written in the first line
+EXPORT_VERSION = 1
+
+# Fields every exported document leaves out; the owner is implied by the export
+OMITTED_FIELDS = {"userId": 0}
+
+
+def ndjson_line(kind: str, doc: dict) -> bytes:
+    return dumps({"type": kind, **serialize(doc)}) + b"\n"
+
+
+async def keyset_pages(collection, query: dict, sort_field: str, batch_size: int) -> AsyncIterator[dict]:
+    """Yield the documents matching `query` in (sort_field, _id) order, one short query per batch.
+
+    Each batch is a separate query resuming after the last document, so no
+    server cursor stays open while the consumer (a slow client) catches
+    up; a long-lived cursor would hit Mongo's idle cursor timeout.
+    """
+    after = {}
+    while True:
+        batch = await collection.find({**query, **after}, OMITTED_FIELDS).sort(
+            [(sort_field, 1), ("_id", 1)] if sort_field != "_id" else [("_id", 1)]
+        ).limit(batch_size).to_list(batch_size)
+        for doc in batch:
+            yield doc
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+        if sort_field == "_id":
+            after = {"_id": {"$gt": last["_id"]}}
+        else:
+            after = {"$or": [
+                {sort_field: {"$gt": last[sort_field]}},
+                {sort_field: last[sort_field], "_id": {"$gt": last["_id"]}},
+            ]}
+
+
+async def export_records(users, projects, conversations, messages, user_id: str,
+                         batch_size: int = 500) -> AsyncIterator[bytes]:
+    """Yield a user's data as NDJSON lines.
+
+    The first line describes the export and the user, then come the
+    projects, then each conversation followed by its messages in order;
+    a final `end` line with per-type counts marks a complete export.
+    Documents are read `batch_size` at a time by keyset queries (messages
+    through the (conversationId, timestamp, _id) index), so memory stays
+    flat however large the history is and no cursor outlives a batch.
+    """
+    owner = ObjectId(user_id)
+    counts: Dict[str, int] = {"project": 0, "conversation": 0, "message": 0}
+
+    user = await users.find_one({"_id": owner}, {"password": 0})
+    yield dumps({
+        "type": "export",
+        "version": EXPORT_VERSION,
+        "exportedAt": datetime.utcnow(),
+        "user": serialize(user) if user else {"id": user_id},
+    }) + b"\n"
+
+    async for project in keyset_pages(projects, {"userId": owner}, "_id", batch_size):
+        counts["project"] += 1
+        yield ndjson_line("project", project)
+
+    async for conversation in keyset_pages(conversations, {"userId": owner}, "_id", batch_size):
+        counts["conversation"] += 1
+        yield ndjson_line("conversation", conversation)
+        async for message in keyset_pages(messages, {"conversationId": conversation["_id"]}, "timestamp", batch_size):
+            counts["message"] += 1
+            yield ndjson_line("message", message)
+
+    yield dumps({"type": "end", "counts": counts}) + b"\n"
+
+
+async def chunked(lines: AsyncIterator[bytes], chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Join small lines into chunks of about `chunk_size` bytes, so each send carries many"""
+    buffer = []
+    size = 0
+    async for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+async def gzipped(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Compress a byte stream into a single gzip member, chunk by chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import os
+import time
+
+
+# `set` without a compare-and-set condition
+ANY = object()
+
+
+class HistoryStore:
+    """Interface for per-session conversation history backends.
+
+    A history is a list of `{"role": ..., "content": ...}` dicts in the shape
+    the Anthropic messages API expects. `get` returns None when the session is
+    unknown (or was evicted) so callers can rebuild it from persisted messages.
+
+    Entries may carry a `version` (the conversation's `lastModified`). A `get`
+    with a version that differs from the stored one is treated as a miss, so
+    a history another worker has since extended is reloaded rather than
+    served stale. The stale entry stays until it is replaced.
+
+    A `set` with `expected` is a compare-and-set: it only stores the
+    history if the session's entry still has the `expected` version, as
+    returned by `version` before the caller read or reloaded the history
+    (None for no entry). Otherwise a concurrent turn stored its history
+    meanwhile, neither history holds both turns, and the entry is dropped
+    so the next turn reloads.
+    """
+
+    def version(self, session_id: str):
+        """Version of the session's live entry, None if there is none"""
+        raise NotImplementedError
+
+    def get(self, session_id: str, version=None) -> Optional[List[dict]]:
+        raise NotImplementedError
+
+    def set(self, session_id: str, messages: List[dict], version=None, expected=ANY) -> bool:
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+
+class _Entry:
+    __slots__ = ("messages", "size", "expires_at", "version")
+
+    def __init__(self, messages: List[dict], size: int, expires_at: float, version=None):
+        self.messages = messages
+        self.size = size
+        self.expires_at = expires_at
+        self.version = version
+
+
+def history_size(messages: List[dict]) -> int:
+    """Approximate memory footprint of a history in bytes"""
+    return sum(len(m["content"].encode("utf-8")) + 64 for m in messages)
+
+
+class InMemoryHistoryStore(HistoryStore):
+    """LRU + TTL bounded history store kept in process memory.
+
+    Evicts the least recently used sessions once either `max_sessions` or
+    `max_bytes` is exceeded, and treats sessions idle for longer than
+    `ttl_seconds` as missing.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale = 0
+        self.conflicts = 0
+
+    @classmethod
+    def from_env(cls) -> "InMemoryHistoryStore":
+        return cls(
+            max_sessions=int(os.environ.get("HISTORY_MAX_SESSIONS", 1000)),
+            max_bytes=int(os.environ.get("HISTORY_MAX_BYTES", 64 * 1024 * 1024)),
+            ttl_seconds=float(os.environ.get("HISTORY_TTL_SECONDS", 3600)),
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, session_id: str):
+        entry = self._entries.get(session_id)
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def version(self, session_id: str):
+        entry = self._entries.get(session_id)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry.version
+
+    def get(self, session_id: str, version=None) -> Optional[List[dict]]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(session_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        if version is not None and entry.version != version:
+            # Kept so a concurrent turn that read it can still compare-and-set
+            self.stale += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        self.hits += 1
+        # Callers append to the returned list, so hand out a copy
+        return list(entry.messages)
+
+    def set(self, session_id: str, messages: List[dict], version=None, expected=ANY) -> bool:
+        if expected is not ANY:
+            if self.version(session_id) != expected:
+                self.delete(session_id)
+                self.conflicts += 1
+                return False
+        if session_id in self._entries:
+            self._remove(session_id)
+        size = history_size(messages)
+        self._entries[session_id] = _Entry(list(messages), size, time.monotonic() + self.ttl_seconds, version)
+        self._bytes += size
+        self._evict()
+        return True
+
+    def delete(self, session_id: str):
+        if session_id in self._entries:
+            self._remove(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale": self.stale,
+            "conflicts": self.conflicts,
+        }
+
+    def _remove(self, session_id: str):
+        entry = self._entries.pop(session_id)
+        self._bytes -= entry.size
+
+    def _evict(self):
+        # A single session larger than max_bytes is still kept on its own so
+        # the current turn has a history to work with
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_sessions or self._bytes > self.max_bytes
+        ):
+            session_id, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
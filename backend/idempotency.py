@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from fastapi import HTTPException
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import hashlib
+import os
+import time
+
+import orjson
+
+
+def request_fingerprint(scope: str, body: Any) -> str:
+    """Hash of who sent a request and what it contained"""
+    return hashlib.sha256(scope.encode() + orjson.dumps(body, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class IdempotencyStore:
+    """Single-flight execution plus Idempotency-Key replay, in process memory.
+
+    Identical requests (same scope and body) that arrive while one is still
+    running wait for and share its result instead of running again; this
+    covers double-clicks with or without a key. When the client sends an
+    Idempotency-Key, the successful result is also kept for `ttl_seconds`
+    so a retry after completion gets the same response. Reusing a key with
+    a different body is rejected with 422. Failures are not remembered, so
+    a retry after an error runs again.
+    """
+
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._flights: Dict[str, asyncio.Task] = {}
+        self._keys: Dict[str, str] = {}
+        self._results: "OrderedDict[str, tuple]" = OrderedDict()
+        self.executed = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    @classmethod
+    def from_env(cls) -> "IdempotencyStore":
+        return cls(
+            ttl_seconds=float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 600)),
+            max_entries=int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 10000)),
+        )
+
+    async def run(self, scope: str, body: Any, fn: Callable[[], Awaitable[Any]], key: Optional[str] = None):
+        """Run `fn` once per in-flight (scope, body), replaying results stored under `key`"""
+        fingerprint = request_fingerprint(scope, body)
+        scoped_key = f"{scope}:{key}" if key else None
+        if scoped_key:
+            result = self._replay(scoped_key, fingerprint)
+            if result is not None:
+                return result[0]
+            if self._keys.setdefault(scoped_key, fingerprint) != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+        try:
+            flight = self._flights.get(fingerprint)
+            if flight is None:
+                # A task of its own, so a caller going away does not cancel
+                # the generation the other callers are waiting on
+                flight = asyncio.ensure_future(fn())
+                self._flights[fingerprint] = flight
+                flight.add_done_callback(lambda _: self._flights.pop(fingerprint, None))
+                self.executed += 1
+            else:
+                self.coalesced += 1
+            result = await asyncio.shield(flight)
+        finally:
+            if scoped_key:
+                self._keys.pop(scoped_key, None)
+
+        if scoped_key:
+            self._remember(scoped_key, fingerprint, result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "stored": len(self._results),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+        }
+
+    def _replay(self, scoped_key: str, fingerprint: str) -> Optional[tuple]:
+        entry = self._results.get(scoped_key)
+        if entry is None:
+            return None
+        stored_fingerprint, result, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._results[scoped_key]
+            return None
+        if stored_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        self.replayed += 1
+        return (result,)
+
+    def _remember(self, scoped_key: str, fingerprint: str, result: Any):
+        self._results[scoped_key] = (fingerprint, result, time.monotonic() + self.ttl_seconds)
+        self._results.move_to_end(scoped_key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
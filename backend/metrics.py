@@ -0,0 +1,272 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from pymongo import monitoring
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond Mongo reads to long generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.type = "counter"
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.type = "histogram"
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(labels, ('le', _format_value(float(bound))))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+class Callback:
+    """A gauge or counter read from live objects when metrics are scraped.
+
+    `fn` returns a number, or a list of (labels dict, number) pairs.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable, type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.fn = fn
+
+    def samples(self) -> Iterable[str]:
+        values = self.fn()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(_labels(labels))} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        # Re-registering a name returns the existing metric, so re-imports are harmless
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def callback(self, name: str, help: str, fn: Callable, type: str = "gauge") -> Callback:
+        self._metrics[name] = Callback(name, help, fn, type)
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                lines.append(f"# error collecting {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response completes, by route and status"
+)
+MONGO_OPERATION_DURATION = REGISTRY.histogram(
+    "mongo_operation_duration_seconds", "MongoDB command latency by collection and operation"
+)
+MONGO_OPERATION_ERRORS = REGISTRY.counter(
+    "mongo_operation_errors_total", "Failed MongoDB commands by collection and operation"
+)
+ANTHROPIC_REQUEST_DURATION = REGISTRY.histogram(
+    "anthropic_request_duration_seconds", "Anthropic API call latency, including retries, by operation and outcome"
+)
+ANTHROPIC_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "anthropic_time_to_first_token_seconds", "Time from opening a streamed Anthropic call to its first text delta"
+)
+ANTHROPIC_TOKENS = REGISTRY.counter(
+    "anthropic_tokens_total", "Anthropic tokens by operation and type, taken from response.usage"
+)
+AI_SCHEDULER_WAIT = REGISTRY.histogram(
+    "ai_scheduler_wait_seconds", "Time chat calls waited for an upstream slot"
+)
+BCRYPT_WAIT = REGISTRY.histogram(
+    "bcrypt_pool_wait_seconds", "Time password hashes waited for a bcrypt worker"
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "How late the event loop woke a periodic timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """Observe the duration of the block, labelled with its outcome (ok, error or cancelled)"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+
+def record_tokens(usage, operation: str):
+    """Count the tokens of an Anthropic `response.usage`"""
+    for field, kind in (
+        ("input_tokens", "input"),
+        ("output_tokens", "output"),
+        ("cache_creation_input_tokens", "cache_creation"),
+        ("cache_read_input_tokens", "cache_read"),
+    ):
+        count = getattr(usage, field, None)
+        if count:
+            ANTHROPIC_TOKENS.inc(count, operation=operation, type=kind)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo listener timing every command by collection and operation.
+
+    Motor runs pymongo on a thread pool, so events arrive on worker threads;
+    the metrics are thread-safe. The collection comes from the started
+    event, which is matched to its outcome by (connection, request id).
+    """
+
+    def __init__(self):
+        self._pending: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore names the cursor id first and the collection under "collection"
+            collection = event.command.get("collection")
+            if not isinstance(collection, str):
+                collection = ""
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        MONGO_OPERATION_DURATION.observe(
+            event.duration_micros / 1e6, collection=self._collection(event), operation=event.command_name
+        )
+
+    def failed(self, event):
+        collection = self._collection(event)
+        MONGO_OPERATION_DURATION.observe(event.duration_micros / 1e6, collection=collection, operation=event.command_name)
+        MONGO_OPERATION_ERRORS.inc(collection=collection, operation=event.command_name)
+
+    def _collection(self, event) -> str:
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), "")
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request by method, route template and status.
+
+    The route label is the matched path template (e.g. /api/projects/{project_id}),
+    so ids do not create new series; requests that matched no route
+    (including ones rejected before routing) are labelled "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status
+            )
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+One-off migration: copy each conversation's userId onto its messages.
+
+Messages saved before search carry no userId, so the (userId, content)
+text index cannot find them. Run once after deploying search:
+
+    python migrations/backfill_message_owners.py [--batch-size 500]
+
+Finding the messages to update scans the whole collection (the text index
+cannot serve `$exists`), so this is kept out of server startup. Running
+it again is harmless: it only touches messages still missing a userId.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+load_dotenv(BACKEND_DIR / ".env")
+
+from database import client, conversations_collection, messages_collection  # noqa: E402
+
+logger = logging.getLogger("backfill_message_owners")
+
+
+async def backfill_message_owners(batch_size: int = 500) -> int:
+    conversation_ids = [
+        group["_id"] async for group in messages_collection.aggregate([
+            {"$match": {"userId": {"$exists": False}}},
+            {"$group": {"_id": "$conversationId"}},
+        ])
+    ]
+    logger.info(f"{len(conversation_ids)} conversations have messages without a userId")
+    updated = 0
+    for start in range(0, len(conversation_ids), batch_size):
+        batch = conversation_ids[start:start + batch_size]
+        async for conversation in conversations_collection.find({"_id": {"$in": batch}}, {"userId": 1}):
+            result = await messages_collection.update_many(
+                {"conversationId": conversation["_id"], "userId": {"$exists": False}},
+                {"$set": {"userId": conversation["userId"]}}
+            )
+            updated += result.modified_count
+        logger.info(f"Backfilled {updated} messages ({min(start + batch_size, len(conversation_ids))}/{len(conversation_ids)} conversations)")
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="conversations looked up per query")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    try:
+        updated = asyncio.run(backfill_message_owners(args.batch_size))
+    finally:
+        client.close()
+    logger.info(f"Done: userId set on {updated} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -68,6 +68,10 @@ class ProjectResponse(BaseModel):
     createdAt: datetime
     lastModified: datetime
 
+class ProjectPage(BaseModel):
+    items: List[ProjectResponse]
+    next_cursor: Optional[str] = None
+
 # Chat Models
 class MessageCreate(BaseModel):
     projectId: Optional[str] = None
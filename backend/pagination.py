@@ -0,0 +1,69 @@
+from fastapi import HTTPException
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import base64
+import json
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(sort_value: datetime, doc_id: ObjectId) -> str:
+    """Opaque cursor pointing just past a document in (sort_value, _id) order"""
+    millis = (sort_value - EPOCH) // timedelta(milliseconds=1)
+    raw = json.dumps({"t": millis, "id": str(doc_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return EPOCH + timedelta(milliseconds=int(data["t"])), ObjectId(data["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(field: str, cursor: Optional[str], descending: bool) -> dict:
+    """Query fragment selecting documents after `cursor` in (field, _id) order"""
+    if not cursor:
+        return {}
+    value, doc_id = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, "_id": {op: doc_id}}
+    ]}
+
+
+def keyset_sort(field: str, descending: bool) -> List[Tuple[str, int]]:
+    direction = -1 if descending else 1
+    return [(field, direction), ("_id", direction)]
+
+
+def page(docs: List[dict], limit: int, field: str) -> Tuple[List[dict], Optional[str]]:
+    """Split a query fetched with `limit + 1` into (items, next_cursor)"""
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    last = docs[-1]
+    return docs, encode_cursor(last[field], last["_id"])
+
+
+def encode_offset(offset: int) -> str:
+    """Opaque cursor for result lists ranked by score, where keyset paging does not apply"""
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_offset(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = int(json.loads(base64.urlsafe_b64decode(padded.encode()))["o"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
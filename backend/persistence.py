@@ -0,0 +1,159 @@
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
+from typing import Dict, List, Tuple
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Bulk write error code for a duplicate _id: the document is already stored
+DUPLICATE_KEY = 11000
+
+
+def is_transient(error: Exception) -> bool:
+    """Errors a retry can fix: lost connections, elections, server selection timeouts"""
+    if isinstance(error, ConnectionFailure):
+        return True
+    return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+
+class WriteBehindQueue:
+    """Background, batched persistence for inserts no response depends on.
+
+    Callers assign `_id` themselves and `insert` returns as soon as the
+    document is queued. A single worker drains the queue, waiting
+    `flush_interval` seconds after the first document so inserts from
+    concurrent requests share one `insert_many` per collection. The queue
+    holds at most `max_pending` documents; beyond that `insert` waits for
+    room (backpressure) instead of growing memory. `flush` waits for the
+    documents queued so far, giving reads in this process read-your-writes,
+    and `stop` flushes everything still queued.
+
+    Responses have already reported these documents as saved, so a batch
+    that fails with a transient error is retried up to `max_attempts` times
+    with exponential backoff (holding up later batches and flushes
+    meanwhile); documents are only dropped on a permanent error or once the
+    attempts are used up. Documents inserted by an attempt whose reply was
+    lost come back as duplicate keys on the retry and count as written.
+    """
+
+    def __init__(self, max_pending: int = 10000, batch_size: int = 500, flush_interval: float = 0.02,
+                 max_attempts: int = 5, retry_delay: float = 0.1, max_retry_delay: float = 5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._worker = None
+        # Documents are written in FIFO order, so a flush only has to wait
+        # until the completed count reaches the enqueued count at call time
+        self._enqueued = 0
+        self._completed = 0
+        self._progress = asyncio.Condition()
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.backpressure_waits = 0
+
+    @classmethod
+    def from_env(cls) -> "WriteBehindQueue":
+        return cls(
+            max_pending=int(os.environ.get("WRITE_BEHIND_MAX_PENDING", 10000)),
+            batch_size=int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 500)),
+            flush_interval=float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", 0.02)),
+            max_attempts=int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", 5)),
+        )
+
+    async def insert(self, collection, document: dict):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put((collection, document))
+        self._enqueued += 1
+
+    async def flush(self):
+        """Wait until every document queued before this call has been written"""
+        target = self._enqueued
+        if self._completed >= target:
+            return
+        async with self._progress:
+            await self._progress.wait_for(lambda: self._completed >= target)
+
+    async def stop(self):
+        """Flush queued documents and stop the worker"""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "backpressure_waits": self.backpressure_waits,
+        }
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Give concurrent requests a moment to add to this batch
+            await asyncio.sleep(self.flush_interval)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                async with self._progress:
+                    self._completed += len(batch)
+                    self._progress.notify_all()
+
+    async def _write(self, batch: List[Tuple[object, dict]]):
+        by_collection: Dict[str, Tuple[object, List[dict]]] = {}
+        for collection, document in batch:
+            by_collection.setdefault(collection.name, (collection, []))[1].append(document)
+
+        for name, (collection, documents) in by_collection.items():
+            await self._insert(name, collection, documents)
+            self.batches += 1
+
+    async def _insert(self, name: str, collection, documents: List[dict]):
+        attempt = 1
+        while True:
+            try:
+                await collection.insert_many(documents, ordered=False)
+                self.written += len(documents)
+                return
+            except BulkWriteError as e:
+                # Per-document errors; duplicates were stored by an earlier attempt
+                errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+                self.written += len(documents) - len(errors)
+                self.failed += len(errors)
+                if errors:
+                    logger.error(f"Write-behind insert into {name} dropped {len(errors)} documents: {errors}")
+                return
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.max_attempts:
+                    self.failed += len(documents)
+                    logger.error(
+                        f"Write-behind insert of {len(documents)} documents into {name} failed "
+                        f"after {attempt} attempts: {e}"
+                    )
+                    return
+                delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+                logger.warning(f"Write-behind insert into {name} failed (attempt {attempt}), retrying in {delay:.2f}s: {e}")
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,327 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import math
+import os
+import time
+
+from auth import user_id_from_token
+from metrics import EVENT_LOOP_LAG
+from serialization import ORJSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+class Limit:
+    """A token bucket: `burst` requests at once, refilled over `period` seconds"""
+
+    __slots__ = ("burst", "period")
+
+    def __init__(self, burst: int, period: float):
+        self.burst = burst
+        self.period = period
+
+    @property
+    def rate(self) -> float:
+        return self.burst / self.period
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["Limit"]:
+        """Parse "<requests>/<seconds>", e.g. "30/60"; "off" disables the limit"""
+        if spec.lower() in ("", "0", "off"):
+            return None
+        burst, period = spec.split("/")
+        return cls(int(burst), float(period))
+
+
+class RateLimiter:
+    """Interface for token bucket backends.
+
+    `hit` takes one token from the bucket at `key` and returns 0 if the
+    request is allowed, otherwise the seconds until a token is available.
+    """
+
+    def __init__(self):
+        self.limited = 0
+
+    async def hit(self, key: str, limit: Limit) -> float:
+        raise NotImplementedError
+
+    @staticmethod
+    def from_env(collection=None) -> "RateLimiter":
+        """Build the backend named by RATE_LIMIT_BACKEND (memory|mongo)"""
+        if os.environ.get("RATE_LIMIT_BACKEND", "memory").lower() == "mongo" and collection is not None:
+            return MongoRateLimiter(collection)
+        return InMemoryRateLimiter(max_keys=int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000)))
+
+
+class InMemoryRateLimiter(RateLimiter):
+    """Token buckets in process memory; the least recently used are dropped past `max_keys`"""
+
+    def __init__(self, max_keys: int = 100000):
+        super().__init__()
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    async def hit(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(limit.burst), now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        self.limited += 1
+        return (1 - bucket[0]) / limit.rate
+
+
+class MongoRateLimiter(RateLimiter):
+    """Token buckets shared by every worker, one document per key.
+
+    Refill and take happen in a single pipeline update, so concurrent
+    workers never lose tokens. Idle buckets are removed by the TTL index on
+    `expiresAt` (see database.INDEXES).
+    """
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+
+    async def hit(self, key: str, limit: Limit) -> float:
+        now = datetime.utcnow()
+        refilled = {"$min": [limit.burst, {"$add": [
+            {"$ifNull": ["$tokens", limit.burst]},
+            {"$multiply": [limit.rate / 1000, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]},
+        ]}]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expiresAt": now + timedelta(seconds=limit.period),
+                }},
+            ],
+            projection={"_id": 0, "allowed": 1, "tokens": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0.0
+        self.limited += 1
+        return (1 - bucket["tokens"]) / limit.rate
+
+
+class LoadShedder:
+    """Rejects requests while the worker is overloaded.
+
+    Tracks requests in flight and measures event-loop lag with a background
+    task that sleeps `interval` seconds and records how late it wakes up.
+    New requests are shed while in-flight requests reach `max_in_flight`
+    or the lag exceeds `max_lag` seconds.
+    """
+
+    def __init__(self, max_in_flight: int = 1000, max_lag: float = 0.5, interval: float = 0.1):
+        self.max_in_flight = max_in_flight
+        self.max_lag = max_lag
+        self.interval = interval
+        self.in_flight = 0
+        self.lag = 0.0
+        self.shed = 0
+        self._monitor = None
+
+    @classmethod
+    def from_env(cls) -> "LoadShedder":
+        return cls(
+            max_in_flight=int(os.environ.get("SHED_MAX_IN_FLIGHT", 1000)),
+            max_lag=float(os.environ.get("SHED_MAX_LOOP_LAG", 0.5)),
+        )
+
+    def start(self):
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.create_task(self._measure_lag())
+
+    async def stop(self):
+        if self._monitor is None:
+            return
+        self._monitor.cancel()
+        try:
+            await self._monitor
+        except asyncio.CancelledError:
+            pass
+        self._monitor = None
+
+    def overloaded(self) -> Optional[str]:
+        if self.in_flight >= self.max_in_flight:
+            return "Too many requests in flight"
+        if self.lag > self.max_lag:
+            return "Server event loop is overloaded"
+        return None
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "loop_lag": self.lag, "shed": self.shed}
+
+    async def _measure_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = max(time.monotonic() - started - self.interval, 0.0)
+            EVENT_LOOP_LAG.observe(self.lag)
+
+
+# Route groups, matched by method (None for any) and path prefix in order; the
+# last one catches the rest of /api. Only sends are "chat": the conversation
+# lists, message pages and search are ordinary reads. WebSocket turns take
+# from the same per-user chat bucket in server.py.
+ROUTE_GROUPS: List[Tuple[Optional[str], str, str]] = [
+    (None, "/api/auth/", "auth"),
+    ("POST", "/api/chat/message", "chat"),
+    (None, "/api/", "crud"),
+]
+
+# Default "<requests>/<seconds>" per group, per user and per IP. Logins and
+# registrations are anonymous, so auth is limited per IP only.
+DEFAULT_LIMITS = {
+    "auth": {"user": "off", "ip": "20/60"},
+    "chat": {"user": "30/60", "ip": "120/60"},
+    "crud": {"user": "300/60", "ip": "1200/60"},
+}
+
+
+def route_group(method: str, path: str) -> Optional[str]:
+    return next(
+        (name for group_method, prefix, name in ROUTE_GROUPS
+         if (group_method is None or group_method == method) and path.startswith(prefix)),
+        None
+    )
+
+
+def limits_from_env() -> Dict[str, Dict[str, Optional[Limit]]]:
+    """Read RATE_LIMIT_<GROUP>_<USER|IP> overrides, e.g. RATE_LIMIT_CHAT_USER=10/60"""
+    return {
+        group: {
+            scope: Limit.parse(os.environ.get(f"RATE_LIMIT_{group.upper()}_{scope.upper()}", default))
+            for scope, default in scopes.items()
+        }
+        for group, scopes in DEFAULT_LIMITS.items()
+    }
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware applying load shedding, then per-user and per-IP rate limits.
+
+    Shed requests get 503 and rate limited ones 429, both with Retry-After.
+    The user is taken from the bearer token (through the auth token cache);
+    requests without a valid token are only limited per IP. Limiter backend
+    errors let the request through rather than failing it.
+
+    Behind a proxy the client IP must come from the proxy, or every client
+    shares the proxy's IP bucket. Either run uvicorn with `--proxy-headers
+    --forwarded-allow-ips=<proxy IPs>`, which puts the client in
+    `scope["client"]`, or set `proxy_hops` (RATE_LIMIT_PROXY_HOPS) to the
+    number of proxies in front of the app: the client is then the entry
+    that many places from the right of X-Forwarded-For, the one appended
+    by the outermost trusted proxy. Entries further left are supplied by
+    the client and never used.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, shedder: LoadShedder, limits=None,
+                 proxy_hops: Optional[int] = None):
+        self.app = app
+        self.limiter = limiter
+        self.shedder = shedder
+        self.limits = limits if limits is not None else limits_from_env()
+        if proxy_hops is None:
+            proxy_hops = int(os.environ.get("RATE_LIMIT_PROXY_HOPS", 0))
+        self.proxy_hops = proxy_hops
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        self.shedder.start()
+
+        reason = self.shedder.overloaded()
+        if reason:
+            self.shedder.shed += 1
+            await self._reject(503, reason, 1, scope, receive, send)
+            return
+
+        retry_after = await self._check_limits(scope)
+        if retry_after:
+            await self._reject(429, "Too many requests", retry_after, scope, receive, send)
+            return
+
+        self.shedder.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.shedder.in_flight -= 1
+
+    async def _check_limits(self, scope) -> float:
+        group = route_group(scope["method"], scope["path"])
+        if group is None:
+            return 0.0
+        limits = self.limits[group]
+        keys = []
+        if limits.get("user"):
+            user_id = self._user_id(scope)
+            if user_id:
+                keys.append((f"{group}:user:{user_id}", limits["user"]))
+        if limits.get("ip"):
+            keys.append((f"{group}:ip:{self._client_ip(scope)}", limits["ip"]))
+
+        retry_after = 0.0
+        for key, limit in keys:
+            try:
+                retry_after = max(retry_after, await self.limiter.hit(key, limit))
+            except Exception as e:
+                logger.error(f"Rate limiter failed for {key}: {e}")
+        return retry_after
+
+    def _user_id(self, scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() != "bearer" or not token:
+                    return None
+                try:
+                    return user_id_from_token(token)
+                except HTTPException:
+                    return None
+        return None
+
+    def _client_ip(self, scope) -> str:
+        if self.proxy_hops:
+            # Proxies append to a single header or add their own; either way the order holds
+            hops = [
+                hop.strip()
+                for name, value in scope["headers"] if name == b"x-forwarded-for"
+                for hop in value.decode("latin-1").split(",")
+            ]
+            if len(hops) >= self.proxy_hops and hops[-self.proxy_hops]:
+                return hops[-self.proxy_hops]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def _reject(self, status_code: int, detail: str, retry_after: float, scope, receive, send):
+        response = ORJSONResponse(
+            status_code=status_code,
+            content={"detail": detail},
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))}
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,168 @@
+from typing import Awaitable, Callable, Optional, TypeVar
+import asyncio
+import os
+import random
+import time
+
+import anthropic
+
+T = TypeVar("T")
+
+# Upstream statuses worth retrying: timeouts, conflicts, rate limits,
+# server errors and Anthropic's 529 "overloaded"
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class AIServiceError(Exception):
+    """An upstream failure to report to the client instead of a reply"""
+
+    def __init__(self, message: str, status_code: int = 502, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fails fast while the upstream looks down.
+
+    Opens after `failure_threshold` consecutive failures. While open, calls
+    are rejected until `reset_timeout` has passed; then a single probe call
+    is let through (half-open) and its outcome closes or re-opens the circuit.
+    A probe that ends without an outcome (cancelled, or a client error that
+    says nothing about upstream health) releases its slot for the next call.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """Raise while the circuit is open; returns True if this call is the half-open probe"""
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        retry_after = max(self.reset_timeout - (time.monotonic() - self.opened_at), 1)
+        raise AIServiceError("The AI service is temporarily unavailable", status_code=503, retry_after=retry_after)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release_probe(self):
+        """Let another call probe; the circuit stays as it was"""
+        self._probing = False
+
+
+class RetryPolicy:
+    """Per-attempt timeout, overall deadline and jittered exponential backoff"""
+
+    def __init__(self, attempt_timeout: float = 60.0, deadline: float = 120.0, max_retries: int = 3,
+                 base_delay: float = 0.5, max_delay: float = 8.0):
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            attempt_timeout=float(os.environ.get("AI_ATTEMPT_TIMEOUT", 60)),
+            deadline=float(os.environ.get("AI_DEADLINE", 120)),
+            max_retries=int(os.environ.get("AI_MAX_RETRIES", 3)),
+        )
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # Full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+
+def classify(error: Exception) -> AIServiceError:
+    """Map an upstream exception to the error reported to the client"""
+    if isinstance(error, AIServiceError):
+        return error
+    if isinstance(error, (asyncio.TimeoutError, anthropic.APITimeoutError)):
+        return AIServiceError("The AI service timed out", status_code=504)
+    if isinstance(error, anthropic.RateLimitError):
+        return AIServiceError("The AI service is rate limited, please retry shortly", status_code=503,
+                              retry_after=_retry_after(error))
+    if isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES:
+        return AIServiceError("The AI service is unavailable", status_code=503, retry_after=_retry_after(error))
+    return AIServiceError("The AI service failed to process the request", status_code=502)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, anthropic.APIConnectionError)):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+async def call_with_resilience(call: Callable[[], Awaitable[T]], policy: RetryPolicy, breaker: CircuitBreaker) -> T:
+    """Run `call` with the circuit breaker, per-attempt timeouts and retries.
+
+    Raises AIServiceError once the error is not retryable, the retries are
+    used up, or the overall deadline would be exceeded.
+    """
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        probe = breaker.before_call()
+        remaining = policy.deadline - (time.monotonic() - started)
+        try:
+            result = await asyncio.wait_for(call(), min(policy.attempt_timeout, remaining))
+        except Exception as e:
+            retryable = is_retryable(e)
+            if retryable:
+                # Client errors (bad request, auth) say nothing about upstream health
+                breaker.record_failure()
+            elif probe:
+                breaker.release_probe()
+            if not retryable or attempt >= policy.max_retries:
+                raise classify(e) from e
+            delay = policy.backoff(attempt, _retry_after(e))
+            if time.monotonic() - started + delay >= policy.deadline:
+                raise classify(e) from e
+            attempt += 1
+            policy.retries += 1
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled (e.g. the client disconnected): no verdict on upstream health
+            if probe:
+                breaker.release_probe()
+            raise
+        breaker.record_success()
+        return result
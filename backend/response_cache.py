@@ -0,0 +1,161 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import hashlib
+import os
+import re
+import time
+
+import orjson
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(content) -> str:
+    if not isinstance(content, str):
+        content = "".join(block.get("text", "") for block in content)
+    return _WHITESPACE.sub(" ", content).strip()
+
+
+def response_key(model: str, system: str, messages: List[dict]) -> str:
+    """Hash of everything that determines a reply.
+
+    Message content is whitespace-normalized, so "How do I  deploy?\\n"
+    and "How do I deploy?" share an entry.
+    """
+    payload = orjson.dumps({
+        "model": model,
+        "system": system,
+        "messages": [[m["role"], _normalize(m["content"])] for m in messages],
+    })
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ResponseCache:
+    """Interface for cached assistant replies, keyed by `response_key`"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, response: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    @staticmethod
+    def from_env(collection=None) -> Optional["ResponseCache"]:
+        """Build the backend named by AI_RESPONSE_CACHE (memory|mongo); disabled by default"""
+        backend = os.environ.get("AI_RESPONSE_CACHE", "").lower()
+        ttl_seconds = float(os.environ.get("AI_RESPONSE_CACHE_TTL", 86400))
+        if backend == "memory":
+            return InMemoryResponseCache(
+                max_entries=int(os.environ.get("AI_RESPONSE_CACHE_SIZE", 1000)),
+                ttl_seconds=ttl_seconds,
+            )
+        if backend == "mongo" and collection is not None:
+            return MongoResponseCache(
+                collection,
+                ttl_seconds=ttl_seconds,
+                max_entries=int(os.environ.get("AI_RESPONSE_CACHE_SIZE", 100000)),
+            )
+        return None
+
+
+class InMemoryResponseCache(ResponseCache):
+    """LRU + TTL bounded reply cache kept in process memory"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    async def set(self, key: str, response: str):
+        self._entries[key] = (response, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        self.stores += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {**super().stats(), "entries": len(self._entries), "evictions": self.evictions}
+
+
+class MongoResponseCache(ResponseCache):
+    """Reply cache shared by every worker, stored in a Mongo collection.
+
+    Documents are `{_id: key, response, expiresAt}`; the TTL index on
+    `expiresAt` (see database.INDEXES) removes expired entries. Within the
+    TTL, a write that takes the collection past `max_entries` deletes the
+    entries closest to expiry, i.e. the least recently stored, through the
+    same index. Workers trimming at once may remove a few extra entries.
+    Hit/miss counters are per process.
+    """
+
+    def __init__(self, collection, ttl_seconds: float = 86400, max_entries: int = 100000):
+        super().__init__()
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        # The TTL monitor only runs once a minute, so check expiry here too
+        doc = await self.collection.find_one(
+            {"_id": key, "expiresAt": {"$gt": datetime.utcnow()}},
+            {"_id": 0, "response": 1}
+        )
+        if doc is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return doc["response"]
+
+    async def set(self, key: str, response: str):
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {"response": response, "expiresAt": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)}},
+            upsert=True
+        )
+        self.stores += 1
+        await self._trim()
+
+    async def _trim(self):
+        # The estimate is read from collection metadata, so this check is cheap
+        excess = await self.collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return
+        oldest = await self.collection.find({}, {"_id": 1}).sort("expiresAt", 1).limit(excess).to_list(excess)
+        result = await self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in oldest]}})
+        self.evictions += result.deleted_count
+
+    def stats(self) -> Dict[str, float]:
+        return {**super().stats(), "evictions": self.evictions}
@@ -0,0 +1,120 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import time
+
+from metrics import AI_SCHEDULER_WAIT
+from tracing import span
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call waited longer than the queue timeout for a slot"""
+
+
+class FairScheduler:
+    """Caps in-flight upstream calls and shares free slots fairly between users.
+
+    Up to `max_concurrency` calls run at once. Callers beyond that wait in a
+    per-key queue, and a freed slot goes to the next key in round-robin
+    order, so one user with many queued requests cannot starve the others.
+    A caller that waits longer than `queue_timeout` gets SchedulerTimeout.
+    """
+
+    def __init__(self, max_concurrency: int = 8, queue_timeout: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._depth = 0
+        self.granted = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @classmethod
+    def from_env(cls) -> "FairScheduler":
+        return cls(
+            max_concurrency=int(os.environ.get("AI_MAX_CONCURRENCY", 8)),
+            queue_timeout=float(os.environ.get("AI_QUEUE_TIMEOUT", 30)),
+        )
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        with span("scheduler"):
+            await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, key: str):
+        started = time.perf_counter()
+        if self._in_flight < self.max_concurrency and not self._depth:
+            self._in_flight += 1
+            self._record_wait(started)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(waiter)
+        self._depth += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait timed out
+                self.release()
+            else:
+                self._discard(key, waiter)
+            self.timeouts += 1
+            raise SchedulerTimeout(f"No upstream slot became free within {self.queue_timeout:g}s")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the caller went away
+                self.release()
+            else:
+                self._discard(key, waiter)
+            raise
+        self._record_wait(started)
+
+    def release(self):
+        # Hand the slot straight to the next waiting key, round-robin
+        while self._queues:
+            key, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            self._depth -= 1
+            if waiters:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": self._depth,
+            "waiting_keys": len(self._queues),
+            "granted": self.granted,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+    def _discard(self, key: str, waiter):
+        waiters = self._queues.get(key)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self._depth -= 1
+        if not waiters:
+            del self._queues[key]
+
+    def _record_wait(self, started: float):
+        waited = time.perf_counter() - started
+        AI_SCHEDULER_WAIT.observe(waited)
+        self.granted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
@@ -0,0 +1,239 @@
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import asyncio
+import math
+import os
+import re
+
+from bson import ObjectId
+
+# Characters of context kept around the first matching term in a snippet
+SNIPPET_LENGTH = 160
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def query_terms(q: str) -> List[str]:
+    """Terms a result should match; quotes are ignored and "-term" negations dropped"""
+    return [term for word in q.split() if not word.startswith("-") for term in tokenize(word)]
+
+
+def snippet(text: str, terms: List[str], length: int = SNIPPET_LENGTH) -> str:
+    """A window of `text` around its first matching term, with ellipses where it was cut"""
+    text = " ".join(text.split())
+    if len(text) <= length:
+        return text
+    match = None
+    if terms:
+        pattern = r"\b(" + "|".join(re.escape(term) for term in sorted(set(terms), key=len, reverse=True)) + r")"
+        match = re.search(pattern, text, re.IGNORECASE)
+    start = max(match.start() - length // 4, 0) if match else 0
+    end = min(start + length, len(text))
+    start = max(end - length, 0)
+    return ("…" if start else "") + text[start:end].strip() + ("…" if end < len(text) else "")
+
+
+def hit(kind: str, doc: dict, conversation_id, score: float, terms: List[str], text: str) -> dict:
+    result = {
+        "type": kind,
+        "conversationId": conversation_id,
+        "snippet": snippet(text, terms),
+        "score": round(score, 4),
+    }
+    if kind == "message":
+        result.update(messageId=doc["_id"], role=doc["role"], timestamp=doc["timestamp"])
+    else:
+        result["timestamp"] = doc["createdAt"]
+    return result
+
+
+class SearchIndex:
+    """Interface for chat history search backends.
+
+    `search` returns up to `limit` hits after the first `offset` of a
+    user's messages and conversation titles, best first, and whether more
+    follow. Hits carry the conversation id; callers join in the rest of the
+    conversation. `add_conversation` and `add_messages` are called after
+    every write so backends that keep their own index stay current.
+    """
+
+    async def search(self, user_id: str, q: str, limit: int, offset: int = 0) -> Tuple[List[dict], bool]:
+        raise NotImplementedError
+
+    def add_conversation(self, conversation: dict):
+        pass
+
+    def add_messages(self, messages: List[dict]):
+        pass
+
+    @staticmethod
+    def from_env(conversations, messages) -> "SearchIndex":
+        """Build the backend named by SEARCH_BACKEND (mongo|memory)"""
+        if os.environ.get("SEARCH_BACKEND", "mongo").lower() == "memory":
+            return InMemorySearchIndex(
+                conversations,
+                messages,
+                max_users=int(os.environ.get("SEARCH_MAX_USERS", 1000))
+            )
+        return MongoSearchIndex(conversations, messages)
+
+
+class MongoSearchIndex(SearchIndex):
+    """Searches with MongoDB `$text` queries.
+
+    Relies on the (userId, text) indexes on messages.content and
+    conversations.title (see database.INDEXES), so the userId scope is part
+    of the index lookup. Both collections are read down to the requested
+    page and merged by text score. `$text` syntax applies: "quoted phrases"
+    and -negated terms.
+    """
+
+    def __init__(self, conversations, messages):
+        self.conversations = conversations
+        self.messages = messages
+
+    async def _top(self, collection, user_id: str, q: str, fields: dict, count: int) -> List[dict]:
+        return await collection.find(
+            {"userId": ObjectId(user_id), "$text": {"$search": q}},
+            {**fields, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).to_list(count)
+
+    async def search(self, user_id: str, q: str, limit: int, offset: int = 0) -> Tuple[List[dict], bool]:
+        count = offset + limit + 1
+        messages, conversations = await asyncio.gather(
+            self._top(self.messages, user_id, q, {"conversationId": 1, "role": 1, "content": 1, "timestamp": 1}, count),
+            self._top(self.conversations, user_id, q, {"title": 1, "createdAt": 1}, count),
+        )
+        terms = query_terms(q)
+        hits = [
+            hit("message", doc, doc["conversationId"], doc["score"], terms, doc["content"]) for doc in messages
+        ] + [
+            hit("conversation", doc, doc["_id"], doc["score"], terms, doc["title"]) for doc in conversations
+        ]
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        return hits[offset:offset + limit], len(hits) > offset + limit
+
+
+class _UserIndex:
+    """Inverted index over one user's messages and conversation titles"""
+
+    def __init__(self):
+        # term -> {doc id: term frequency}
+        self.postings: Dict[str, Dict[ObjectId, int]] = {}
+        # doc id -> (kind, document, conversation id, length in terms)
+        self.docs: Dict[ObjectId, tuple] = {}
+        self.total_length = 0
+        self.loaded = asyncio.Event()
+        self.failed = False
+
+    def add(self, kind: str, doc: dict, conversation_id: ObjectId, text: str):
+        if doc["_id"] in self.docs:
+            return
+        terms = tokenize(text)
+        self.docs[doc["_id"]] = (kind, doc, conversation_id, len(terms))
+        self.total_length += len(terms)
+        for term in terms:
+            posting = self.postings.setdefault(term, {})
+            posting[doc["_id"]] = posting.get(doc["_id"], 0) + 1
+
+    def rank(self, terms: List[str], k1: float = 1.2, b: float = 0.75) -> List[Tuple[ObjectId, float]]:
+        """BM25 scores of the documents matching any term, best first"""
+        if not self.docs:
+            return []
+        average_length = self.total_length / len(self.docs) or 1
+        scores: Dict[ObjectId, float] = {}
+        for term in set(terms):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (len(self.docs) - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, frequency in posting.items():
+                length = self.docs[doc_id][3]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (k1 + 1) / (
+                    frequency + k1 * (1 - b + b * length / average_length)
+                )
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class InMemorySearchIndex(SearchIndex):
+    """Per-user inverted indexes in process memory, for MongoDB deployments without text indexes.
+
+    A user's index is built from Mongo on their first search and then kept
+    current from writes in this process; the least recently searched are
+    dropped past `max_users`. Ranking is BM25 over whole words, with any
+    term matching. With several workers, each only sees its own writes
+    since it built an index, so this suits single-worker deployments.
+    """
+
+    def __init__(self, conversations, messages, max_users: int = 1000):
+        self.conversations = conversations
+        self.messages = messages
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self.builds = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def add_conversation(self, conversation: dict):
+        index = self._users.get(str(conversation["userId"]))
+        if index is not None:
+            index.add("conversation", conversation, conversation["_id"], conversation["title"])
+
+    def add_messages(self, messages: List[dict]):
+        for message in messages:
+            index = self._users.get(str(message["userId"]))
+            if index is not None:
+                index.add("message", message, message["conversationId"], message["content"])
+
+    async def _index(self, user_id: str) -> _UserIndex:
+        index = self._users.get(user_id)
+        if index is not None:
+            self._users.move_to_end(user_id)
+            await index.loaded.wait()
+            if index.failed:
+                # The build this search waited on failed; start another
+                return await self._index(user_id)
+            return index
+
+        # Registered before loading, so writes made meanwhile are indexed too;
+        # documents seen both ways are only added once
+        index = self._users[user_id] = _UserIndex()
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        try:
+            conversations = await self.conversations.find(
+                {"userId": ObjectId(user_id)}, {"title": 1, "createdAt": 1}
+            ).to_list(None)
+            for conversation in conversations:
+                index.add("conversation", conversation, conversation["_id"], conversation["title"])
+            cursor = self.messages.find(
+                {"conversationId": {"$in": [conversation["_id"] for conversation in conversations]}},
+                {"conversationId": 1, "role": 1, "content": 1, "timestamp": 1}
+            )
+            async for message in cursor:
+                index.add("message", message, message["conversationId"], message["content"])
+        except BaseException:
+            index.failed = True
+            if self._users.get(user_id) is index:
+                del self._users[user_id]
+            raise
+        finally:
+            index.loaded.set()
+        self.builds += 1
+        return index
+
+    async def search(self, user_id: str, q: str, limit: int, offset: int = 0) -> Tuple[List[dict], bool]:
+        index = await self._index(user_id)
+        terms = query_terms(q)
+        ranked = index.rank(terms)
+        hits = []
+        for doc_id, score in ranked[offset:offset + limit]:
+            kind, doc, conversation_id, _ = index.docs[doc_id]
+            text = doc["content"] if kind == "message" else doc["title"]
+            hits.append(hit(kind, doc, conversation_id, score, terms, text))
+        return hits, len(ranked) > offset + limit
@@ -0,0 +1,66 @@
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from typing import Any
+import os
+
+import orjson
+
+from tracing import span
+
+# Set VALIDATE_RESPONSES=true to run trusted documents through their
+# response_model again (e.g. while developing a new endpoint)
+VALIDATE_RESPONSES = os.environ.get("VALIDATE_RESPONSES", "false").lower() == "true"
+
+
+def serialize(value: Any) -> Any:
+    """Convert a Mongo document into JSON-ready data in a single pass.
+
+    Builds new containers instead of mutating the input: `_id` keys become
+    `id` and every ObjectId becomes a string. Datetimes are left as-is for
+    orjson, which encodes them natively in the same ISO format FastAPI uses.
+    """
+    if isinstance(value, dict):
+        return {
+            ("id" if key == "_id" else key): serialize(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [serialize(item) for item in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+def loads(data) -> Any:
+    """Parse JSON; raises ValueError on invalid input"""
+    return orjson.loads(data)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson; also accepts raw ObjectIds"""
+
+    def render(self, content: Any) -> bytes:
+        with span("serialize"):
+            return dumps(content)
+
+
+def trusted(content: Any):
+    """Return already-serialized internal data without re-validating it.
+
+    Returning a Response from a handler makes FastAPI skip its
+    response_model, which is redundant for documents this app built or
+    projected itself. The response_model still documents the schema.
+    """
+    if VALIDATE_RESPONSES:
+        return content
+    return ORJSONResponse(content)
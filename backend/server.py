@@ -1,55 +1,100 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, WebSocket, WebSocketDisconnect
 from dotenv import load_dotenv
+from fastapi.responses import Response, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from pathlib import Path
+import asyncio
 import logging
-from typing import List
+import math
+import os
+from typing import Dict, List, Literal, Optional, Tuple
 from bson import ObjectId
+from pydantic import ValidationError
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-from database import users_collection, projects_collection, conversations_collection, messages_collection
+from database import (
+    users_collection, projects_collection, conversations_collection, messages_collection,
+    response_cache_collection, rate_limits_collection, ensure_indexes
+)
 from models import (
     UserCreate, UserLogin, UserResponse, UserUpdate, TokenResponse,
-    ProjectCreate, ProjectUpdate, ProjectResponse,
+    ProjectCreate, ProjectUpdate, ProjectResponse, ProjectPage,
     MessageCreate, MessageResponse, ConversationResponse,
     SocialLinks, WorkspaceSettings
 )
-from auth import hash_password, verify_password, create_access_token, get_current_user
+from auth import (
+    hash_password, verify_password, create_access_token, get_current_user, user_id_from_token,
+    bcrypt_pool, token_cache
+)
 from ai_service import AIService
+from response_cache import ResponseCache
+from scheduler import SchedulerTimeout
+from resilience import AIServiceError
+from pagination import decode_offset, encode_offset, keyset_filter, keyset_sort, page
+from serialization import ORJSONResponse, dumps, loads, serialize, trusted
+from persistence import WriteBehindQueue
+from idempotency import IdempotencyStore
+from search import SearchIndex
+from export import chunked, export_records, gzipped
+from ratelimit import AdmissionControlMiddleware, LoadShedder, RateLimiter, limits_from_env
+from metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from tracing import SlowRequestProfiler, TracingMiddleware, span
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create API router with /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Initialize AI Service
-ai_service = AIService()
+# Initialize AI Service; AI_RESPONSE_CACHE=memory|mongo enables the first-turn reply cache
+ai_service = AIService(response_cache=ResponseCache.from_env(response_cache_collection))
+
+# Batches message inserts off the request path
+write_behind = WriteBehindQueue.from_env()
+
+# Coalesces duplicate chat requests and replays Idempotency-Key retries
+idempotency = IdempotencyStore.from_env()
+
+# Chat history search; SEARCH_BACKEND=mongo (text indexes) or memory
+search_index = SearchIndex.from_env(conversations_collection, messages_collection)
 
-# Helper function to convert ObjectId to string
-def serialize_doc(doc):
-    if doc and "_id" in doc:
-        doc["id"] = str(doc["_id"])
-        del doc["_id"]
-    return doc
+# Projections matching the response models, so reads only pull the fields
+# a response needs (and never the password hash unless asked for)
+def projection(model) -> dict:
+    return {field: 1 for field in model.model_fields if field != "id"}
+
+USER_PROJECTION = projection(UserResponse)
+PROJECT_PROJECTION = projection(ProjectResponse)
+MESSAGE_PROJECTION = projection(MessageResponse)
+CONVERSATION_PROJECTION = {"projectId": 1, "title": 1, "createdAt": 1, "lastModified": 1}
+
+# Maximum number of stored messages used to rebuild a conversation's context
+HISTORY_LOAD_LIMIT = int(os.environ.get("HISTORY_LOAD_LIMIT", 50))
+
+# Most recent messages embedded per conversation by the `full` list view;
+# each conversation is one aggregation result, bounded by the 16 MB BSON limit
+CONVERSATION_FULL_MESSAGES = int(os.environ.get("CONVERSATION_FULL_MESSAGES", 100))
 
 # ============= AUTH ENDPOINTS =============
 
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserCreate):
     # Check if user exists
-    existing_user = await users_collection.find_one({"email": user_data.email})
+    with span("mongo"):
+        existing_user = await users_collection.find_one({"email": user_data.email}, {"_id": 1})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
     user_dict = {
         "email": user_data.email,
-        "password": hash_password(user_data.password),
+        "password": await hash_password(user_data.password),
         "displayName": user_data.displayName,
         "avatar": f"https://api.dicebear.com/7.x/avataaars/svg?seed={user_data.displayName}",
         "bio": "",
@@ -60,49 +105,55 @@ async def register(user_data: UserCreate):
         "createdAt": datetime.utcnow()
     }
     
-    result = await users_collection.insert_one(user_dict)
-    user_dict["id"] = str(result.inserted_id)
+    try:
+        with span("mongo"):
+            result = await users_collection.insert_one(user_dict)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create token
-    token = create_access_token({"sub": user_dict["id"]})
+    token = create_access_token({"sub": str(result.inserted_id)})
     
     # Prepare response
     del user_dict["password"]
-    del user_dict["_id"]
     
-    return {
-        "user": user_dict,
+    return trusted({
+        "user": serialize(user_dict),
         "token": token
-    }
+    })
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     # Find user
-    user = await users_collection.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
+    with span("mongo"):
+        user = await users_collection.find_one(
+            {"email": credentials.email},
+            {**USER_PROJECTION, "password": 1}
+        )
+    if not user or not await verify_password(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Create token
     token = create_access_token({"sub": str(user["_id"])})
     
     # Prepare response
-    user = serialize_doc(user)
+    user = serialize(user)
     del user["password"]
     
-    return {
+    return trusted({
         "user": user,
         "token": token
-    }
+    })
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_me(user_id: str = Depends(get_current_user)):
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    with span("mongo"):
+        user = await users_collection.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user = serialize_doc(user)
-    del user["password"]
-    return user
+    return trusted(serialize(user))
 
 # ============= PROFILE ENDPOINTS =============
 
@@ -110,23 +161,38 @@ async def get_me(user_id: str = Depends(get_current_user)):
 async def update_profile(profile_data: UserUpdate, user_id: str = Depends(get_current_user)):
     update_dict = profile_data.dict(exclude_unset=True)
     
-    if update_dict:
-        await users_collection.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": update_dict}
-        )
-    
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
-    user = serialize_doc(user)
-    del user["password"]
-    return user
+    with span("mongo"):
+        if update_dict:
+            user = await users_collection.find_one_and_update(
+                {"_id": ObjectId(user_id)},
+                {"$set": update_dict},
+                projection=USER_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            user = await users_collection.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return trusted(serialize(user))
 
 # ============= PROJECTS ENDPOINTS =============
 
-@api_router.get("/projects", response_model=List[ProjectResponse])
-async def get_projects(user_id: str = Depends(get_current_user)):
-    projects = await projects_collection.find({"userId": ObjectId(user_id)}).to_list(1000)
-    return [serialize_doc(project) for project in projects]
+@api_router.get("/projects", response_model=ProjectPage)
+async def get_projects(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
+    query = {"userId": ObjectId(user_id), **keyset_filter("lastModified", cursor, descending=True)}
+    with span("mongo"):
+        projects = await projects_collection.find(query, PROJECT_PROJECTION).sort(
+            keyset_sort("lastModified", descending=True)
+        ).to_list(limit + 1)
+    projects, next_cursor = page(projects, limit, "lastModified")
+    return trusted({
+        "items": serialize(projects),
+        "next_cursor": next_cursor
+    })
 
 @api_router.post("/projects", response_model=ProjectResponse)
 async def create_project(project_data: ProjectCreate, user_id: str = Depends(get_current_user)):
@@ -136,12 +202,11 @@ async def create_project(project_data: ProjectCreate, user_id: str = Depends(get
     project_dict["createdAt"] = datetime.utcnow()
     project_dict["lastModified"] = datetime.utcnow()
     
-    result = await projects_collection.insert_one(project_dict)
-    project_dict["id"] = str(result.inserted_id)
-    del project_dict["_id"]
+    with span("mongo"):
+        await projects_collection.insert_one(project_dict)
     del project_dict["userId"]
     
-    return project_dict
+    return trusted(serialize(project_dict))
 
 @api_router.put("/projects/{project_id}", response_model=ProjectResponse)
 async def update_project(
@@ -149,154 +214,731 @@ async def update_project(
     project_data: ProjectUpdate,
     user_id: str = Depends(get_current_user)
 ):
-    # Verify project belongs to user
-    project = await projects_collection.find_one({
-        "_id": ObjectId(project_id),
-        "userId": ObjectId(user_id)
-    })
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
+    # The ownership check is part of the filter, so a project that is not
+    # the user's is neither updated nor returned
+    owned = {"_id": ObjectId(project_id), "userId": ObjectId(user_id)}
     
     update_dict = project_data.dict(exclude_unset=True)
-    if update_dict:
-        update_dict["lastModified"] = datetime.utcnow()
-        await projects_collection.update_one(
-            {"_id": ObjectId(project_id)},
-            {"$set": update_dict}
-        )
-    
-    project = await projects_collection.find_one({"_id": ObjectId(project_id)})
-    project = serialize_doc(project)
-    del project["userId"]
-    return project
+    with span("mongo"):
+        if update_dict:
+            update_dict["lastModified"] = datetime.utcnow()
+            project = await projects_collection.find_one_and_update(
+                owned,
+                {"$set": update_dict},
+                projection=PROJECT_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            project = await projects_collection.find_one(owned, PROJECT_PROJECTION)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return trusted(serialize(project))
 
 @api_router.delete("/projects/{project_id}")
 async def delete_project(project_id: str, user_id: str = Depends(get_current_user)):
-    result = await projects_collection.delete_one({
-        "_id": ObjectId(project_id),
-        "userId": ObjectId(user_id)
-    })
+    with span("mongo"):
+        result = await projects_collection.delete_one({
+            "_id": ObjectId(project_id),
+            "userId": ObjectId(user_id)
+        })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
     return {"message": "Project deleted successfully"}
 
 # ============= CHAT ENDPOINTS =============
 
-@api_router.post("/chat/message")
-async def send_message(message_data: MessageCreate, user_id: str = Depends(get_current_user)):
+def utc_now() -> datetime:
+    """Current UTC time truncated to the millisecond precision MongoDB stores"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+async def get_or_create_conversation(message_data: MessageCreate, user_id: str, turn_time: datetime):
+    """Return (conversation, created), creating the conversation if needed.
+
+    An existing conversation's lastModified is bumped to `turn_time` in the
+    same round trip that looks it up; the returned document holds the value
+    from before the bump, which versions the cached history.
+    """
     conversation_id = message_data.conversationId
     
-    # Create or get conversation
     if not conversation_id:
+        # The session id must be unique: conversations created in the same
+        # millisecond (e.g. on one WebSocket) would otherwise share a history
+        new_id = ObjectId()
         conversation_dict = {
+            "_id": new_id,
             "userId": ObjectId(user_id),
             "projectId": ObjectId(message_data.projectId) if message_data.projectId else None,
             "title": message_data.message[:50] + "..." if len(message_data.message) > 50 else message_data.message,
-            "sessionId": f"session_{datetime.utcnow().timestamp()}",
-            "createdAt": datetime.utcnow(),
-            "lastModified": datetime.utcnow()
+            "sessionId": f"session_{new_id}",
+            "createdAt": turn_time,
+            "lastModified": turn_time
         }
-        result = await conversations_collection.insert_one(conversation_dict)
-        conversation_id = str(result.inserted_id)
-        session_id = conversation_dict["sessionId"]
-    else:
-        conversation = await conversations_collection.find_one({"_id": ObjectId(conversation_id)})
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-        session_id = conversation["sessionId"]
+        with span("mongo"):
+            await conversations_collection.insert_one(conversation_dict)
+        search_index.add_conversation(conversation_dict)
+        return conversation_dict, True
     
-    # Save user message
-    user_message = {
+    with span("mongo"):
+        conversation = await conversations_collection.find_one_and_update(
+            {"_id": ObjectId(conversation_id), "userId": ObjectId(user_id)},
+            {"$set": {"lastModified": turn_time}},
+            projection={"sessionId": 1, "lastModified": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation, False
+
+def new_message(conversation_id: str, user_id: str, role: str, content: str) -> dict:
+    """Build a message document; the id is assigned here so responses can reference it.
+
+    The owner's userId is copied from the conversation so search can scope
+    messages by user without a join.
+    """
+    return {
+        "_id": ObjectId(),
         "conversationId": ObjectId(conversation_id),
-        "role": "user",
-        "content": message_data.message,
+        "userId": ObjectId(user_id),
+        "role": role,
+        "content": content,
         "timestamp": datetime.utcnow()
     }
-    await messages_collection.insert_one(user_message)
+
+async def save_messages(*messages: dict):
+    """Queue messages for write-behind persistence.
+
+    A turn's messages are only saved once the assistant reply exists, so a
+    failed upstream call leaves nothing behind in the conversation.
+    """
+    with span("write_behind"):
+        for message in messages:
+            await write_behind.insert(messages_collection, message)
+    search_index.add_messages(messages)
+
+def message_response(message: dict) -> dict:
+    return {
+        "id": str(message["_id"]),
+        "role": message["role"],
+        "content": message["content"],
+        "timestamp": message["timestamp"]
+    }
+
+async def load_persisted_history(conversation_id: str, version: Optional[datetime] = None) -> Tuple[List[dict], bool]:
+    """Rebuild a session history from the most recent stored messages of a conversation.
+
+    Reads at most HISTORY_LOAD_LIMIT messages through the
+    (conversationId, timestamp, _id) index; `_id` breaks timestamp ties. The
+    turn in progress is not saved yet; AIService appends it itself.
+
+    Returns (history, complete). `version` is the conversation's
+    lastModified, set when its latest turn started; that turn's messages
+    are timestamped after it. If the newest stored message is older, the
+    turn is still queued on the worker that ran it (flush only covers this
+    worker's queue), so the history is reported incomplete.
+    """
+    await write_behind.flush()
+    messages = await messages_collection.find(
+        {"conversationId": ObjectId(conversation_id)},
+        {"_id": 0, "role": 1, "content": 1, "timestamp": 1}
+    ).sort([("timestamp", -1), ("_id", -1)]).to_list(HISTORY_LOAD_LIMIT)
+    complete = version is None or bool(messages) and messages[0]["timestamp"] >= version
+    messages.reverse()
     
-    # Get AI response
-    ai_response = await ai_service.chat(session_id, message_data.message)
+    # The Anthropic API requires the history to start with a user turn
+    while messages and messages[0]["role"] != "user":
+        messages.pop(0)
+    return [{"role": msg["role"], "content": msg["content"]} for msg in messages], complete
+
+def history_loader(conversation: dict, created: bool):
+    if created:
+        return None
+    return lambda: load_persisted_history(str(conversation["_id"]), conversation["lastModified"])
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+async def process_message(message_data: MessageCreate, user_id: str) -> dict:
+    # Create or get conversation, bumping its lastModified
+    turn_time = utc_now()
+    conversation, created = await get_or_create_conversation(message_data, user_id, turn_time)
+    conversation_id = str(conversation["_id"])
     
-    # Save AI message
-    ai_message = {
-        "conversationId": ObjectId(conversation_id),
-        "role": "assistant",
-        "content": ai_response,
-        "timestamp": datetime.utcnow()
-    }
-    result = await messages_collection.insert_one(ai_message)
+    user_message = new_message(conversation_id, user_id, "user", message_data.message)
     
-    # Update conversation lastModified
-    await conversations_collection.update_one(
-        {"_id": ObjectId(conversation_id)},
-        {"$set": {"lastModified": datetime.utcnow()}}
+    # Get AI response. The conversation's lastModified versions the cached
+    # history, so a history another worker has extended is reloaded from Mongo
+    ai_response = await ai_service.chat(
+        conversation["sessionId"],
+        message_data.message,
+        load_history=history_loader(conversation, created),
+        version=conversation["lastModified"],
+        next_version=turn_time,
+        user_id=user_id
     )
     
+    # Save the turn
+    ai_message = new_message(conversation_id, user_id, "assistant", ai_response)
+    await save_messages(user_message, ai_message)
+    
     return {
         "conversationId": conversation_id,
-        "message": {
-            "id": str(result.inserted_id),
-            "role": "assistant",
-            "content": ai_response,
-            "timestamp": ai_message["timestamp"]
-        }
+        "message": message_response(ai_message)
     }
 
-@api_router.get("/chat/conversations")
-async def get_conversations(user_id: str = Depends(get_current_user)):
-    conversations = await conversations_collection.find(
-        {"userId": ObjectId(user_id)}
-    ).sort("lastModified", -1).to_list(100)
+@api_router.post("/chat/message")
+async def send_message(
+    message_data: MessageCreate,
+    user_id: str = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Send a message and return the assistant reply.
+
+    Identical requests from the same user that arrive while one is in
+    flight share its result, and an `Idempotency-Key` header makes retries
+    after completion return the original reply instead of a new one.
+    """
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 characters")
+    content = await idempotency.run(
+        user_id,
+        message_data.model_dump(),
+        lambda: process_message(message_data, user_id),
+        key=idempotency_key
+    )
+    return trusted(content)
+
+@api_router.post("/chat/message/stream")
+async def send_message_stream(message_data: MessageCreate, user_id: str = Depends(get_current_user)):
+    """Stream the assistant reply as Server-Sent Events.
+
+    Emits a `start` event with the conversation id, one `token` event per text
+    delta, then `done` with the persisted assistant message (or `error`).
+    """
+    turn_time = utc_now()
+    conversation, created = await get_or_create_conversation(message_data, user_id, turn_time)
+    conversation_id = str(conversation["_id"])
+    user_message = new_message(conversation_id, user_id, "user", message_data.message)
     
-    result = []
-    for conv in conversations:
-        messages = await messages_collection.find(
-            {"conversationId": conv["_id"]}
-        ).sort("timestamp", 1).to_list(1000)
+    async def event_stream():
+        yield sse_event("start", {"conversationId": conversation_id})
         
-        conv = serialize_doc(conv)
-        if conv.get("projectId"):
-            conv["projectId"] = str(conv["projectId"])
-        del conv["userId"]
-        del conv["sessionId"]
+        chunks = []
+        try:
+            async for text in ai_service.chat_stream(
+                conversation["sessionId"],
+                message_data.message,
+                load_history=history_loader(conversation, created),
+                version=conversation["lastModified"],
+                next_version=turn_time,
+                user_id=user_id
+            ):
+                chunks.append(text)
+                yield sse_event("token", {"text": text})
+        except SchedulerTimeout:
+            yield sse_event("error", {"detail": "The AI service is busy, please retry shortly", "retryAfter": 5})
+            return
+        except AIServiceError as e:
+            logger.warning(f"Streaming chat failed for conversation {conversation_id}: {e} ({e.__cause__!r})")
+            retry_after = math.ceil(e.retry_after) if e.retry_after else None
+            yield sse_event("error", {"detail": str(e), "retryAfter": retry_after})
+            return
+        except Exception as e:
+            logger.error(f"Streaming chat failed for conversation {conversation_id}: {e}")
+            yield sse_event("error", {"detail": "The AI service failed to generate a response"})
+            return
         
-        conv["messages"] = [serialize_doc(msg) for msg in messages]
-        for msg in conv["messages"]:
-            del msg["conversationId"]
-        
-        result.append(conv)
+        # Only a completed turn is persisted; a disconnect cancels the
+        # generator above and nothing is written
+        ai_message = new_message(conversation_id, user_id, "assistant", "".join(chunks))
+        await save_messages(user_message, ai_message)
+        yield sse_event("done", {"conversationId": conversation_id, "message": message_response(ai_message)})
     
-    return result
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ============= CHAT WEBSOCKET =============
+
+WS_AUTH_TIMEOUT = float(os.environ.get("WS_AUTH_TIMEOUT", 10))
+WS_MAX_IN_FLIGHT = int(os.environ.get("WS_MAX_IN_FLIGHT", 4))
+
+# Application-defined close code (4000-4999) for failed authentication
+WS_UNAUTHORIZED = 4401
+
+async def receive_frame(websocket: WebSocket):
+    """Receive one frame and parse it as JSON; binary or invalid frames raise ValueError"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("text") is None:
+        raise ValueError("binary frame")
+    return loads(message["text"])
+
+class ChatSocket:
+    """One authenticated chat WebSocket carrying any number of conversations.
+
+    Each `message` frame starts a generation task keyed by its request id;
+    frames for different requests interleave on the socket. Turns on the
+    same conversation run one at a time. The socket remembers the
+    conversations it has used (ownership, session id and the lastModified
+    it last wrote), so a follow-up turn only needs a conditional update.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.conversations: Dict[str, dict] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, **frame):
+        # Frames from concurrent generations must not interleave mid-write
+        async with self._send_lock:
+            await self.websocket.send_text(dumps(frame).decode())
+
+    async def serve(self):
+        try:
+            while True:
+                try:
+                    frame = await receive_frame(self.websocket)
+                except ValueError:
+                    await self.send(type="error", detail="Frames must be JSON objects")
+                    continue
+                if not isinstance(frame, dict):
+                    await self.send(type="error", detail="Frames must be JSON objects")
+                    continue
+                kind = frame.get("type")
+                if kind == "message":
+                    await self.start(frame)
+                elif kind == "cancel":
+                    task = self.tasks.get(frame.get("id"))
+                    if task:
+                        task.cancel()
+                elif kind == "ping":
+                    await self.send(type="pong")
+                else:
+                    await self.send(type="error", id=frame.get("id"), detail=f"Unknown frame type {kind!r}")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in list(self.tasks.values()):
+                task.cancel()
+
+    async def start(self, frame: dict):
+        request_id = frame.get("id")
+        if not isinstance(request_id, str) or not request_id:
+            await self.send(type="error", detail="Message frames need a string id")
+            return
+        if request_id in self.tasks:
+            await self.send(type="error", id=request_id, detail="A request with this id is already running")
+            return
+        if len(self.tasks) >= WS_MAX_IN_FLIGHT:
+            await self.send(type="error", id=request_id, detail="Too many generations in flight on this socket")
+            return
+        try:
+            message_data = MessageCreate(
+                message=frame.get("message"),
+                conversationId=frame.get("conversationId"),
+                projectId=frame.get("projectId")
+            )
+        except ValidationError:
+            await self.send(type="error", id=request_id, detail="Invalid message frame")
+            return
+        task = asyncio.create_task(self.generate(request_id, message_data))
+        self.tasks[request_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(request_id, None))
+
+    async def open_conversation(self, message_data: MessageCreate, turn_time: datetime):
+        """Like get_or_create_conversation, but skips the lookup for conversations this socket knows"""
+        known = self.conversations.get(message_data.conversationId)
+        if known:
+            result = await conversations_collection.update_one(
+                {"_id": known["_id"], "lastModified": known["lastModified"]},
+                {"$set": {"lastModified": turn_time}}
+            )
+            if result.matched_count:
+                conversation, created = known, False
+            else:
+                # Changed elsewhere (another tab or device); look it up again
+                conversation, created = await get_or_create_conversation(message_data, self.user_id, turn_time)
+        else:
+            conversation, created = await get_or_create_conversation(message_data, self.user_id, turn_time)
+        self.conversations[str(conversation["_id"])] = {
+            "_id": conversation["_id"],
+            "sessionId": conversation["sessionId"],
+            "lastModified": turn_time
+        }
+        return conversation, created
+
+    async def generate(self, request_id: str, message_data: MessageCreate):
+        try:
+            retry_after = await rate_limiter.hit(f"chat:user:{self.user_id}", chat_user_limit) if chat_user_limit else 0
+            if retry_after:
+                await self.send(type="error", id=request_id, detail="Too many requests", retryAfter=math.ceil(retry_after))
+                return
+            lock = self.locks.setdefault(message_data.conversationId, asyncio.Lock()) if message_data.conversationId else asyncio.Lock()
+            async with lock:
+                turn_time = utc_now()
+                conversation, created = await self.open_conversation(message_data, turn_time)
+                conversation_id = str(conversation["_id"])
+                user_message = new_message(conversation_id, self.user_id, "user", message_data.message)
+                await self.send(type="start", id=request_id, conversationId=conversation_id)
+                
+                chunks = []
+                async for text in ai_service.chat_stream(
+                    conversation["sessionId"],
+                    message_data.message,
+                    load_history=history_loader(conversation, created),
+                    version=conversation["lastModified"],
+                    next_version=turn_time,
+                    user_id=self.user_id
+                ):
+                    chunks.append(text)
+                    await self.send(type="token", id=request_id, text=text)
+                
+                ai_message = new_message(conversation_id, self.user_id, "assistant", "".join(chunks))
+                await save_messages(user_message, ai_message)
+            await self.send(type="done", id=request_id, conversationId=conversation_id, message=message_response(ai_message))
+        except asyncio.CancelledError:
+            # Nothing is persisted for a cancelled turn; tell the client if it is still there
+            try:
+                await self.send(type="cancelled", id=request_id)
+            except Exception:
+                pass
+            raise
+        except SchedulerTimeout:
+            await self.send(type="error", id=request_id, detail="The AI service is busy, please retry shortly", retryAfter=5)
+        except AIServiceError as e:
+            retry_after = math.ceil(e.retry_after) if e.retry_after else None
+            await self.send(type="error", id=request_id, detail=str(e), status=e.status_code, retryAfter=retry_after)
+        except HTTPException as e:
+            await self.send(type="error", id=request_id, detail=e.detail, status=e.status_code)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"WebSocket chat failed for request {request_id}: {e}")
+            try:
+                await self.send(type="error", id=request_id, detail="The AI service failed to generate a response")
+            except Exception:
+                pass
+
+async def authenticate_socket(websocket: WebSocket) -> Optional[str]:
+    """Accept the socket and resolve its user from a first {"type": "auth"} frame.
+
+    The token is not taken from the query string: URLs end up in server
+    and proxy access logs, and the token is valid for 30 days.
+    """
+    await websocket.accept()
+    try:
+        frame = await asyncio.wait_for(receive_frame(websocket), WS_AUTH_TIMEOUT)
+        if not isinstance(frame, dict) or frame.get("type") != "auth":
+            raise ValueError("expected an auth frame")
+        return user_id_from_token(frame.get("token") or "")
+    except (HTTPException, ValueError, asyncio.TimeoutError):
+        await websocket.close(code=WS_UNAUTHORIZED)
+    except WebSocketDisconnect:
+        pass
+    return None
+
+@api_router.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """Chat over one long-lived connection; see contracts.md for the frame protocol"""
+    user_id = await authenticate_socket(websocket)
+    if user_id is None:
+        return
+    socket = ChatSocket(websocket, user_id)
+    await socket.send(type="ready", userId=user_id)
+    await socket.serve()
+
+def conversations_pipeline(match: dict, view: str, limit: int) -> List[dict]:
+    """Aggregation returning a page of a user's conversations with their messages joined in.
+
+    `view="summary"` embeds only the most recent message as `lastMessage`;
+    `view="full"` embeds the most recent CONVERSATION_FULL_MESSAGES in
+    order. Longer histories are read through the messages endpoint, since
+    a conversation with its messages must fit in one result document.
+    """
+    if view == "summary":
+        field, message_limit, reorder = "lastMessage", 1, []
+    else:
+        field, message_limit = "messages", CONVERSATION_FULL_MESSAGES
+        reorder = [{"$sort": {"timestamp": 1, "_id": 1}}]
+    
+    return [
+        {"$match": match},
+        {"$sort": {"lastModified": -1, "_id": -1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": messages_collection.name,
+            "localField": "_id",
+            "foreignField": "conversationId",
+            "pipeline": [
+                {"$sort": {"timestamp": -1, "_id": -1}},
+                {"$limit": message_limit},
+                *reorder,
+                {"$project": MESSAGE_PROJECTION}
+            ],
+            "as": field
+        }},
+        {"$project": {**CONVERSATION_PROJECTION, field: 1}}
+    ]
+
+def serialize_conversation(conv: dict) -> dict:
+    conv = serialize(conv)
+    if "lastMessage" in conv:
+        last = conv["lastMessage"]
+        conv["lastMessage"] = last[0] if last else None
+    return conv
+
+async def list_conversations(match: dict, view: str, limit: int, cursor: Optional[str]) -> dict:
+    match = {**match, **keyset_filter("lastModified", cursor, descending=True)}
+    with span("write_behind"):
+        await write_behind.flush()
+    with span("mongo"):
+        conversations = await conversations_collection.aggregate(
+            conversations_pipeline(match, view, limit + 1)
+        ).to_list(None)
+    conversations, next_cursor = page(conversations, limit, "lastModified")
+    with span("serialize"):
+        items = [serialize_conversation(conv) for conv in conversations]
+    return trusted({
+        "items": items,
+        "next_cursor": next_cursor
+    })
+
+@api_router.get("/chat/conversations")
+async def get_conversations(
+    view: Literal["full", "summary"] = "summary",
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
+    return await list_conversations({"userId": ObjectId(user_id)}, view, limit, cursor)
 
 @api_router.get("/chat/conversations/{project_id}")
-async def get_project_conversations(project_id: str, user_id: str = Depends(get_current_user)):
-    conversations = await conversations_collection.find({
-        "userId": ObjectId(user_id),
-        "projectId": ObjectId(project_id)
-    }).sort("lastModified", -1).to_list(100)
+async def get_project_conversations(
+    project_id: str,
+    view: Literal["full", "summary"] = "summary",
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
+    return await list_conversations(
+        {"userId": ObjectId(user_id), "projectId": ObjectId(project_id)},
+        view,
+        limit,
+        cursor
+    )
+
+@api_router.get("/chat/conversations/{conversation_id}/messages")
+async def get_conversation_messages(
+    conversation_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
+    with span("mongo"):
+        conversation = await conversations_collection.find_one(
+            {"_id": ObjectId(conversation_id), "userId": ObjectId(user_id)},
+            {"_id": 1}
+        )
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
     
-    result = []
-    for conv in conversations:
-        messages = await messages_collection.find(
-            {"conversationId": conv["_id"]}
-        ).sort("timestamp", 1).to_list(1000)
-        
-        conv = serialize_doc(conv)
-        conv["projectId"] = str(conv["projectId"])
-        del conv["userId"]
-        del conv["sessionId"]
-        
-        conv["messages"] = [serialize_doc(msg) for msg in messages]
-        for msg in conv["messages"]:
-            del msg["conversationId"]
-        
-        result.append(conv)
+    query = {"conversationId": conversation["_id"], **keyset_filter("timestamp", cursor, descending=False)}
+    with span("write_behind"):
+        await write_behind.flush()
+    with span("mongo"):
+        messages = await messages_collection.find(query, MESSAGE_PROJECTION).sort(
+            keyset_sort("timestamp", descending=False)
+        ).to_list(limit + 1)
+    messages, next_cursor = page(messages, limit, "timestamp")
+    return trusted({
+        "items": serialize(messages),
+        "next_cursor": next_cursor
+    })
+
+# Deepest result a search can page to
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", 500))
+
+@api_router.get("/chat/search")
+async def search_chats(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
+    """Search the user's messages and conversation titles, best matches first.
+
+    Each item is a snippet around the match with its conversation's id,
+    title and project; message hits also carry the message id and role.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    offset = decode_offset(cursor)
+    if offset >= SEARCH_MAX_RESULTS:
+        return trusted({"items": [], "next_cursor": None})
+    limit = min(limit, SEARCH_MAX_RESULTS - offset)
+    
+    with span("write_behind"):
+        await write_behind.flush()
+    with span("search"):
+        hits, more = await search_index.search(user_id, q, limit, offset)
+    
+    # Join in the title and project of each hit's conversation
+    with span("mongo"):
+        conversations = {
+            conversation["_id"]: conversation
+            async for conversation in conversations_collection.find(
+                {"_id": {"$in": list({h["conversationId"] for h in hits})}, "userId": ObjectId(user_id)},
+                {"title": 1, "projectId": 1}
+            )
+        }
+    items = []
+    for h in hits:
+        conversation = conversations.get(h["conversationId"])
+        if conversation is None:
+            continue
+        items.append({**h, "title": conversation["title"], "projectId": conversation.get("projectId")})
+    
+    next_offset = offset + limit
+    return trusted({
+        "items": serialize(items),
+        "next_cursor": encode_offset(next_offset) if more and next_offset < SEARCH_MAX_RESULTS else None
+    })
+
+# ============= EXPORT =============
+
+# Documents fetched per Mongo round trip while exporting
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 500))
+
+@api_router.get("/export")
+async def export_data(
+    compress: Literal["none", "gzip"] = "none",
+    user_id: str = Depends(get_current_user)
+):
+    """Stream the user's projects, conversations and messages as NDJSON.
+
+    Documents are read and written a batch at a time, so the export never
+    holds more than a batch in memory. `compress=gzip` returns the same
+    stream as a .ndjson.gz file.
+    """
+    with span("write_behind"):
+        await write_behind.flush()
     
-    return result
+    async def body():
+        try:
+            stream = chunked(export_records(
+                users_collection, projects_collection, conversations_collection, messages_collection,
+                user_id, batch_size=EXPORT_BATCH_SIZE
+            ))
+            if compress == "gzip":
+                stream = gzipped(stream)
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            # The response has started, so the client sees a stream without the final "end" line
+            logger.error(f"Export failed for user {user_id}: {e}")
+            raise
+    
+    filename = f"repbep-export-{datetime.utcnow():%Y%m%d}.ndjson" + (".gz" if compress == "gzip" else "")
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if compress == "gzip" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+    )
+
+# ============= METRICS =============
+
+def cache_sizes() -> list:
+    sizes = [
+        ({"cache": "history"}, ai_service.conversations.stats()["sessions"]),
+        ({"cache": "summaries"}, len(ai_service.context)),
+        ({"cache": "jwt"}, len(token_cache)),
+        ({"cache": "idempotency"}, idempotency.stats()["stored"]),
+    ]
+    if hasattr(ai_service.response_cache, "__len__"):
+        sizes.append(({"cache": "response"}, len(ai_service.response_cache)))
+    if hasattr(rate_limiter, "__len__"):
+        sizes.append(({"cache": "rate_limit"}, len(rate_limiter)))
+    if hasattr(search_index, "__len__"):
+        sizes.append(({"cache": "search_users"}, len(search_index)))
+    return sizes
+
+def cache_lookups(field: str) -> list:
+    lookups = [
+        ({"cache": "history"}, ai_service.conversations.stats()[field]),
+        ({"cache": "jwt"}, token_cache.stats()[field]),
+    ]
+    if ai_service.response_cache is not None:
+        lookups.append(({"cache": "response"}, ai_service.response_cache.stats()[field]))
+    return lookups
+
+REGISTRY.callback("cache_entries", "Entries held by in-process caches", cache_sizes)
+REGISTRY.callback("cache_hits_total", "Cache hits", lambda: cache_lookups("hits"), type="counter")
+REGISTRY.callback("cache_misses_total", "Cache misses", lambda: cache_lookups("misses"), type="counter")
+REGISTRY.callback("history_store_bytes", "Approximate size of cached conversation histories",
+                  lambda: ai_service.conversations.stats().get("bytes", 0))
+REGISTRY.callback("ai_scheduler_in_flight", "Claude calls holding a scheduler slot",
+                  lambda: ai_service.scheduler.stats()["in_flight"])
+REGISTRY.callback("ai_scheduler_queue_depth", "Claude calls waiting for a scheduler slot",
+                  lambda: ai_service.scheduler.stats()["queue_depth"])
+REGISTRY.callback("anthropic_retries_total", "Retried Anthropic calls",
+                  lambda: ai_service.retry_policy.retries, type="counter")
+REGISTRY.callback("anthropic_circuit_open", "1 while the Anthropic circuit breaker is open or half-open",
+                  lambda: int(ai_service.breaker.state != "closed"))
+REGISTRY.callback("write_behind_pending", "Messages queued for write-behind persistence",
+                  lambda: write_behind.stats()["pending"])
+REGISTRY.callback("write_behind_documents_total", "Write-behind documents by result", lambda: [
+    ({"result": "written"}, write_behind.stats()["written"]),
+    ({"result": "failed"}, write_behind.stats()["failed"]),
+], type="counter")
+REGISTRY.callback("bcrypt_pool_waiting", "Password hashes waiting for a bcrypt worker",
+                  lambda: bcrypt_pool.stats()["waiting"])
+REGISTRY.callback("http_requests_in_flight", "Admitted HTTP requests still in progress",
+                  lambda: load_shedder.in_flight)
+REGISTRY.callback("http_requests_rejected_total", "Requests rejected by admission control", lambda: [
+    ({"reason": "shed"}, load_shedder.shed),
+    ({"reason": "rate_limited"}, rate_limiter.limited),
+], type="counter")
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint, outside /api so it is not routed publicly"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.exception_handler(SchedulerTimeout)
+async def scheduler_timeout_handler(request: Request, exc: SchedulerTimeout):
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "The AI service is busy, please retry shortly"},
+        headers={"Retry-After": "5"}
+    )
+
+@app.exception_handler(AIServiceError)
+async def ai_service_error_handler(request: Request, exc: AIServiceError):
+    logger.warning(f"AI service error on {request.url.path}: {exc} ({exc.__cause__!r})")
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after else None
+    return ORJSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=headers)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Admission control: load shedding plus per-user/per-IP rate limits. Added
+# before CORS so rejections still carry CORS headers.
+rate_limiter = RateLimiter.from_env(rate_limits_collection)
+load_shedder = LoadShedder.from_env()
+chat_user_limit = limits_from_env()["chat"]["user"]
+app.add_middleware(AdmissionControlMiddleware, limiter=rate_limiter, shedder=load_shedder)
+
+# Per-request spans as a Server-Timing header; PROFILE_SLOW_REQUESTS_MS also
+# dumps a stack profile of requests slower than that to PROFILE_DIR
+app.add_middleware(TracingMiddleware, profiler=SlowRequestProfiler.from_env())
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -305,6 +947,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so request latency includes admission control and CORS
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -312,7 +957,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     from database import client
+    await write_behind.stop()
+    await load_shedder.stop()
     client.close()
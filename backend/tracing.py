@@ -0,0 +1,209 @@
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Time spent per named step within one request"""
+
+    __slots__ = ("spans",)
+
+    def __init__(self):
+        # name -> [total seconds, calls]
+        self.spans: Dict[str, list] = {}
+
+    def add(self, name: str, seconds: float):
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def server_timing(self, total: float) -> str:
+        """The spans as a Server-Timing header value, durations in milliseconds"""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, (seconds, _) in self.spans.items()]
+        parts.append(f"app;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def breakdown(self) -> Dict[str, dict]:
+        return {name: {"ms": round(seconds * 1000, 3), "calls": calls} for name, (seconds, calls) in self.spans.items()}
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+class span:
+    """Time a step of the current request: `with span("mongo"): ...`
+
+    Spans with the same name add up. Outside a traced request this is a
+    no-op, so library code can be instrumented unconditionally.
+    """
+
+    __slots__ = ("name", "trace", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class SlowRequestProfiler:
+    """Samples the event loop thread's stack and dumps it for slow requests.
+
+    A daemon thread records the loop thread's stack every `interval`
+    seconds into a ring buffer covering the last `window` seconds. When a
+    request takes longer than `threshold` seconds, the samples taken while
+    it ran are written to `directory` as collapsed stacks (one
+    "frame;frame;frame count" line per stack, ready for flamegraph tools)
+    under a JSON header with the route, status and span breakdown. A
+    request's time runs until its response starts: a streamed body (SSE
+    chat, exports) is paced by the upstream or the client, not by this
+    worker, and would make every stream look slow. The loop is shared, so
+    samples show whatever it was busy with during the request, which is
+    what makes it slow. At most one dump is written every
+    `min_dump_interval` seconds.
+    """
+
+    def __init__(self, directory: str, threshold: float = 1.0, interval: float = 0.005,
+                 window: float = 120.0, min_dump_interval: float = 10.0):
+        self.directory = Path(directory)
+        self.threshold = threshold
+        self.interval = interval
+        self.min_dump_interval = min_dump_interval
+        self._samples: deque = deque(maxlen=int(window / interval))
+        self._thread = None
+        self._loop_thread_id = None
+        self._last_dump = 0.0
+        self.dumps = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SlowRequestProfiler"]:
+        """Enabled by PROFILE_SLOW_REQUESTS_MS; dumps go to PROFILE_DIR"""
+        threshold_ms = os.environ.get("PROFILE_SLOW_REQUESTS_MS")
+        if not threshold_ms:
+            return None
+        return cls(
+            directory=os.environ.get("PROFILE_DIR", "/tmp/repbep-profiles"),
+            threshold=float(threshold_ms) / 1000,
+            interval=float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000,
+            min_dump_interval=float(os.environ.get("PROFILE_MIN_DUMP_INTERVAL", 10)),
+        )
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while True:
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                self._samples.append((time.perf_counter(), ";".join(stack)))
+            time.sleep(self.interval)
+
+    def maybe_dump(self, method: str, route: str, status: int, started: float, ended: float, trace: Trace):
+        if ended - started < self.threshold or ended - self._last_dump < self.min_dump_interval:
+            return
+        self._last_dump = ended
+        samples = [stack for at, stack in list(self._samples) if started <= at <= ended]
+        header = {
+            "method": method,
+            "route": route,
+            "status": status,
+            "duration_ms": round((ended - started) * 1000, 3),
+            "spans": trace.breakdown(),
+            "samples": len(samples),
+            "interval_ms": self.interval * 1000,
+        }
+        # File IO off the event loop
+        asyncio.get_running_loop().run_in_executor(None, self._write, header, samples)
+
+    def _write(self, header: dict, samples: List[str]):
+        counts: Dict[str, int] = {}
+        for stack in samples:
+            counts[stack] = counts.get(stack, 0) + 1
+        name = re.sub(r"[^A-Za-z0-9]+", "_", f"{header['method']} {header['route']}").strip("_")
+        path = self.directory / f"slow-{time.strftime('%Y%m%d-%H%M%S')}-{name}.txt"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(path, "w") as f:
+                f.write("# " + orjson.dumps(header).decode() + "\n")
+                for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                    f.write(f"{stack} {count}\n")
+            self.dumps += 1
+            logger.warning(f"Slow request {header['method']} {header['route']} took {header['duration_ms']}ms; profile written to {path}")
+        except OSError as e:
+            logger.error(f"Failed to write slow request profile {path}: {e}")
+
+
+class TracingMiddleware:
+    """ASGI middleware giving each request a Trace and a Server-Timing header.
+
+    The header is added when the response starts, so for streamed responses
+    it covers the steps before the first byte. Requests slow to start their
+    response are handed to the profiler, if one is configured.
+    """
+
+    def __init__(self, app, profiler: Optional[SlowRequestProfiler] = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.profiler is not None:
+            self.profiler.start()
+        trace = Trace()
+        token = _current.set(trace)
+        started = time.perf_counter()
+        responded = None
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status, responded
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                responded = time.perf_counter()
+                timing = trace.server_timing(responded - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if self.profiler is not None:
+                route = getattr(scope.get("route"), "path", scope["path"])
+                ended = responded if responded is not None else time.perf_counter()
+                self.profiler.maybe_dump(scope["method"], route, status, started, ended, trace)
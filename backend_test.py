@@ -278,19 +278,24 @@ class RepbepAPITester:
         success, status_code, response = await self.make_request("GET", "/projects")
         
         if success and status_code == 200:
-            if isinstance(response, list):
-                project_count = len(response)
+            if isinstance(response, dict) and isinstance(response.get("items"), list) and "next_cursor" in response:
+                projects = response["items"]
+                project_count = len(projects)
                 self.log_test(
                     "GET /api/projects", 
                     True, 
                     f"Projects retrieved successfully. Status: {status_code}. Found {project_count} projects",
-                    {"project_count": project_count, "projects": [p.get("name") for p in response]}
+                    {
+                        "project_count": project_count,
+                        "projects": [p.get("name") for p in projects],
+                        "next_cursor": response["next_cursor"]
+                    }
                 )
             else:
                 self.log_test(
                     "GET /api/projects", 
                     False, 
-                    f"Response is not a list. Status: {status_code}",
+                    f"Response is not a page with items and next_cursor. Status: {status_code}",
                     response
                 )
         else:
@@ -468,12 +473,13 @@ class RepbepAPITester:
             self.log_test("GET /api/chat/conversations", False, "No auth token available", None)
             return
             
-        success, status_code, response = await self.make_request("GET", "/chat/conversations")
+        success, status_code, response = await self.make_request("GET", "/chat/conversations?view=full")
         
         if success and status_code == 200:
-            if isinstance(response, list):
-                conversation_count = len(response)
-                total_messages = sum(len(conv.get("messages", [])) for conv in response)
+            if isinstance(response, dict) and isinstance(response.get("items"), list) and "next_cursor" in response:
+                conversations = response["items"]
+                conversation_count = len(conversations)
+                total_messages = sum(len(conv.get("messages", [])) for conv in conversations)
                 self.log_test(
                     "GET /api/chat/conversations", 
                     True, 
@@ -481,14 +487,15 @@ class RepbepAPITester:
                     {
                         "conversation_count": conversation_count,
                         "total_messages": total_messages,
-                        "conversations": [{"id": conv.get("id"), "title": conv.get("title"), "message_count": len(conv.get("messages", []))} for conv in response]
+                        "conversations": [{"id": conv.get("id"), "title": conv.get("title"), "message_count": len(conv.get("messages", []))} for conv in conversations],
+                        "next_cursor": response["next_cursor"]
                     }
                 )
             else:
                 self.log_test(
                     "GET /api/chat/conversations", 
                     False, 
-                    f"Response is not a list. Status: {status_code}",
+                    f"Response is not a page with items and next_cursor. Status: {status_code}",
                     response
                 )
         else:
@@ -33,8 +33,8 @@ const Dashboard = () => {
 
   const loadProjects = async () => {
     try {
-      const data = await projectsAPI.getAll();
-      setProjects(data.slice(0, 3));
+      const { items } = await projectsAPI.list({ limit: 3 });
+      setProjects(items);
     } catch (error) {
       console.error('Failed to load projects:', error);
     }
@@ -42,11 +42,12 @@ const Dashboard = () => {
 
   const loadConversations = async () => {
     try {
-      const conversations = await chatAPI.getConversations();
-      if (conversations.length > 0) {
-        const latestConv = conversations[0];
+      const { items } = await chatAPI.getConversations({ limit: 1, view: 'summary' });
+      if (items.length > 0) {
+        const latestConv = items[0];
+        const { items: history } = await chatAPI.getMessages(latestConv.id, { limit: 1000 });
         setConversationId(latestConv.id);
-        setMessages(latestConv.messages);
+        setMessages(history);
       }
     } catch (error) {
       console.error('Failed to load conversations:', error);
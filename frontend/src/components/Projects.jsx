@@ -13,16 +13,18 @@ import { toast } from '../hooks/use-toast';
 const Projects = () => {
   const [searchQuery, setSearchQuery] = useState('');
   const [projects, setProjects] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     loadProjects();
   }, []);
 
-  const loadProjects = async () => {
+  const loadProjects = async (cursor = null) => {
     try {
-      const data = await projectsAPI.getAll();
-      setProjects(data);
+      const data = await projectsAPI.list({ cursor });
+      setProjects(prev => (cursor ? [...prev, ...data.items] : data.items));
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error('Failed to load projects:', error);
       toast({
@@ -87,7 +89,7 @@ const Projects = () => {
         <div className="flex flex-col sm:flex-row justify-between items-start sm:items-center gap-4 mb-8">
           <div>
             <h1 className="text-3xl font-bold text-white">Projects</h1>
-            <p className="text-gray-400 mt-1">{projects.length} total projects</p>
+            <p className="text-gray-400 mt-1">{projects.length}{nextCursor ? '+' : ''} projects</p>
           </div>
           <Button className="bg-emerald-600 hover:bg-emerald-700">
             <Plus className="w-4 h-4 mr-2" />
@@ -184,6 +186,18 @@ const Projects = () => {
           ))}
         </div>
 
+        {nextCursor && (
+          <div className="flex justify-center mt-8">
+            <Button
+              variant="outline"
+              className="border-gray-700 hover:bg-gray-800"
+              onClick={() => loadProjects(nextCursor)}
+            >
+              Load More
+            </Button>
+          </div>
+        )}
+
         {/* Empty State */}
         {filteredProjects.length === 0 && (
           <div className="text-center py-12">
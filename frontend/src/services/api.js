@@ -64,10 +64,13 @@ export const profileAPI = {
   },
 };
 
+// List endpoints are cursor-paginated: each call returns one page as
+// { items, next_cursor }; pass next_cursor back as `cursor` for the next page
+
 // Projects API
 export const projectsAPI = {
-  getAll: async () => {
-    const response = await apiClient.get('/projects');
+  list: async (params = {}) => {
+    const response = await apiClient.get('/projects', { params });
     return response.data;
   },
   create: async (data) => {
@@ -84,18 +87,49 @@ export const projectsAPI = {
   },
 };
 
+const newIdempotencyKey = () =>
+  window.crypto?.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+const SEND_RETRIES = 2;
+
+// A lost connection or a 502/503/504 may have hit a send that still completed
+const isRetryableSendError = (error) =>
+  !error.response || [502, 503, 504].includes(error.response.status);
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 // Chat API
 export const chatAPI = {
-  sendMessage: async (data) => {
-    const response = await apiClient.post('/chat/message', data);
+  // One key per send, reused by its retries, so the backend replays the
+  // original reply instead of generating a second one
+  sendMessage: async (data, idempotencyKey = newIdempotencyKey()) => {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const response = await apiClient.post('/chat/message', data, {
+          headers: { 'Idempotency-Key': idempotencyKey },
+        });
+        return response.data;
+      } catch (error) {
+        if (attempt >= SEND_RETRIES || !isRetryableSendError(error)) {
+          throw error;
+        }
+        const retryAfter = Number(error.response?.headers?.['retry-after']);
+        await sleep(Math.min(retryAfter > 0 ? retryAfter * 1000 : 1000 * (attempt + 1), 10000));
+      }
+    }
+  },
+  getConversations: async (params = {}) => {
+    const response = await apiClient.get('/chat/conversations', { params });
     return response.data;
   },
-  getConversations: async () => {
-    const response = await apiClient.get('/chat/conversations');
+  getProjectConversations: async (projectId, params = {}) => {
+    const response = await apiClient.get(`/chat/conversations/${projectId}`, { params });
     return response.data;
   },
-  getProjectConversations: async (projectId) => {
-    const response = await apiClient.get(`/chat/conversations/${projectId}`);
+  getMessages: async (conversationId, params = {}) => {
+    const response = await apiClient.get(`/chat/conversations/${conversationId}/messages`, { params });
     return response.data;
   },
 };
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from history_store import InMemoryHistoryStore
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+    from ai_service import AIService
+    return AIService(history_store=InMemoryHistoryStore())
+
+
+def turn(name: str):
+    return [{"role": "user", "content": name}, {"role": "assistant", "content": f"reply to {name}"}]
+
+
+def loader(history, complete):
+    async def load():
+        return history, complete
+    return load
+
+
+def test_a_complete_reload_is_cached_under_the_next_version(service):
+    history, read_version = asyncio.run(service.get_history("s", loader(turn("m0"), True), version=1))
+    service.store_history("s", history + turn("m1"), 2, read_version)
+    assert service.conversations.get("s", version=2) == turn("m0") + turn("m1")
+
+
+def test_an_incomplete_reload_is_used_but_not_cached(service):
+    # Another worker bumped the version but has not written its turn yet
+    service.conversations.set("s", turn("m0"), version=1)
+    history, read_version = asyncio.run(service.get_history("s", loader(turn("m0"), False), version=2))
+    assert history == turn("m0")
+
+    service.store_history("s", history + turn("m2"), 3, read_version)
+    assert service.conversations.version("s") is None
+    assert service.conversations.get("s", version=3) is None
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+from auth import BcryptPool
+from metrics import BCRYPT_WAIT
+
+
+def wait_count() -> int:
+    return sum(entry[2] for entry in BCRYPT_WAIT._values.values())
+
+
+def test_waits_are_observed_and_a_cancelled_queued_call_leaves_the_gauge():
+    async def main():
+        pool = BcryptPool(max_workers=1)
+        observed = wait_count()
+        busy = threading.Event()
+        release = threading.Event()
+
+        def blocking():
+            busy.set()
+            release.wait(5)
+            return "hashed"
+
+        running = asyncio.create_task(pool.run(blocking))
+        await asyncio.get_running_loop().run_in_executor(None, busy.wait, 5)
+        queued = asyncio.create_task(pool.run(lambda: "never"))
+        await asyncio.sleep(0.01)
+        assert pool.stats()["waiting"] == 1
+
+        # Cancelled while still queued behind the running hash
+        queued.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await running == "hashed"
+        assert queued.cancelled()
+        await asyncio.sleep(0.05)
+        assert pool.stats()["waiting"] == 0
+        assert pool.stats()["calls"] == 1
+        assert wait_count() == observed + 1
+
+    asyncio.run(main())
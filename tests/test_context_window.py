@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+
+from context_window import ContextWindow, history_tokens
+
+
+class FakeMessages:
+    """Answers summary calls with a numbered summary, or fails when told to"""
+
+    def __init__(self):
+        self.prompts = []
+        self.fail = False
+
+    async def create(self, **kwargs):
+        self.prompts.append(kwargs["messages"][0]["content"])
+        if self.fail:
+            raise ConnectionError("upstream down")
+        return SimpleNamespace(
+            content=[SimpleNamespace(text=f"summary {len(self.prompts)}")],
+            usage=SimpleNamespace(input_tokens=1, output_tokens=1,
+                                  cache_creation_input_tokens=0, cache_read_input_tokens=0),
+        )
+
+
+def turns(count: int, start: int = 0):
+    history = []
+    for i in range(start, start + count):
+        history.append({"role": "user", "content": f"question {i} " + "x" * 40})
+        history.append({"role": "assistant", "content": f"answer {i} " + "y" * 40})
+    return history
+
+
+def window(max_tokens: int = 100, keep_turns: int = 2):
+    messages = FakeMessages()
+    return ContextWindow(SimpleNamespace(messages=messages), "model", max_tokens=max_tokens,
+                         keep_turns=keep_turns, summary_max_tokens=10), messages
+
+
+def ask(history, i):
+    return history + [{"role": "user", "content": f"question {i} " + "x" * 40}]
+
+
+def test_a_history_within_budget_is_sent_verbatim():
+    context, messages = window(max_tokens=10000)
+    history = ask(turns(3), 3)
+    assert asyncio.run(context.build("s", history)) == (None, history)
+    assert messages.prompts == []
+    assert len(context) == 0
+
+
+def test_folding_keeps_whole_turns_starting_with_a_user_message():
+    context, messages = window()
+    history = ask(turns(4), 4)
+    summary, sent = asyncio.run(context.build("s", history))
+
+    assert summary == "summary 1"
+    assert sent[0]["role"] == "user"
+    assert sent == history[-len(sent):]
+    assert history_tokens(sent) <= context.max_tokens - context.summary_max_tokens
+    assert "question 0" in messages.prompts[0] and "(none)" in messages.prompts[0]
+
+
+def test_a_second_fold_only_summarizes_the_messages_that_fell_out():
+    context, messages = window()
+    history = ask(turns(4), 4)
+    _, first = asyncio.run(context.build("s", history))
+    folded = len(history) - len(first)
+
+    # Three more turns push the tail over budget again
+    history = history + [{"role": "assistant", "content": "answer 4 " + "y" * 40}] + turns(3, start=5)
+    history = ask(history, 8)
+    summary, sent = asyncio.run(context.build("s", history))
+
+    assert summary == "summary 2"
+    assert sent == history[-len(sent):]
+    second_prompt = messages.prompts[1]
+    assert "Existing summary:\nsummary 1" in second_prompt
+    # Messages covered by the first summary are not sent again
+    assert all(message["content"] not in second_prompt for message in history[:folded])
+    assert history[folded]["content"] in second_prompt
+
+
+def test_a_history_that_no_longer_lines_up_discards_the_summary():
+    context, messages = window()
+    asyncio.run(context.build("s", ask(turns(4), 4)))
+
+    # Rebuilt from a different window of stored messages
+    reloaded = ask(turns(4, start=10), 14)
+    summary, _ = asyncio.run(context.build("s", reloaded))
+    assert summary == "summary 2"
+    assert "(none)" in messages.prompts[1]
+
+
+def test_a_failed_summary_drops_the_oldest_turns_instead():
+    context, messages = window()
+    messages.fail = True
+    history = ask(turns(4), 4)
+    summary, sent = asyncio.run(context.build("s", history))
+
+    assert summary is None
+    assert sent[0]["role"] == "user"
+    assert sent == history[-len(sent):]
+    assert history_tokens(sent) <= context.max_tokens
+    assert len(context) == 0
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from bson import ObjectId
+
+from export import export_records
+
+
+class FakeCursor:
+    def __init__(self, collection, docs):
+        self.collection = collection
+        self.docs = docs
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length):
+        self.collection.queries += 1
+        return self.docs[:length]
+
+
+class FakeCollection:
+    """Enough of a Motor collection for keyset paging: equality, $gt and $or filters"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = 0
+
+    def _matches(self, doc, query):
+        for key, condition in query.items():
+            if key == "$or":
+                if not any(self._matches(doc, branch) for branch in condition):
+                    return False
+            elif isinstance(condition, dict):
+                if not doc[key] > condition["$gt"]:
+                    return False
+            elif doc.get(key) != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor(self, [
+            {k: v for k, v in doc.items() if k not in (projection or {})}
+            for doc in self.docs if self._matches(doc, query)
+        ])
+
+    async def find_one(self, query, projection=None):
+        docs = self.find(query, projection).docs
+        return docs[0] if docs else None
+
+
+def test_export_pages_every_collection_by_keyset():
+    user_id = ObjectId()
+    conversations = [{"_id": ObjectId(), "userId": user_id, "title": f"c{i}"} for i in range(5)]
+    # Messages share timestamps, so paging has to break ties on _id
+    messages = [
+        {"_id": ObjectId(), "userId": user_id, "conversationId": conversation["_id"], "timestamp": i // 4, "content": str(i)}
+        for conversation in conversations[:2] for i in range(7)
+    ]
+    message_collection = FakeCollection(messages)
+
+    async def run():
+        return [line async for line in export_records(
+            FakeCollection([{"_id": user_id, "password": "hash", "email": "a@b.com"}]),
+            FakeCollection([{"_id": ObjectId(), "userId": user_id, "name": "p"}]),
+            FakeCollection(conversations + [{"_id": ObjectId(), "userId": ObjectId(), "title": "other"}]),
+            message_collection,
+            str(user_id),
+            batch_size=2
+        )]
+
+    lines = [json.loads(line) for line in asyncio.run(run())]
+    assert lines[0]["type"] == "export" and "password" not in lines[0]["user"]
+    assert lines[-1] == {"type": "end", "counts": {"project": 1, "conversation": 5, "message": 14}}
+    assert [line["title"] for line in lines if line["type"] == "conversation"] == [f"c{i}" for i in range(5)]
+    exported = [line["id"] for line in lines if line["type"] == "message"]
+    assert exported == [str(message["_id"]) for message in messages]
+    assert all("userId" not in line for line in lines[1:-1])
+    # 2 conversations with 7 messages need 4 pages each, 3 without messages need 1 each
+    assert message_collection.queries == 11
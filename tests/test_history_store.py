@@ -0,0 +1,49 @@
+from history_store import InMemoryHistoryStore
+
+
+def turn(name: str):
+    return [{"role": "user", "content": name}, {"role": "assistant", "content": f"reply to {name}"}]
+
+
+def test_get_with_another_version_is_a_miss_that_keeps_the_entry():
+    store = InMemoryHistoryStore()
+    store.set("s", turn("m0"), version=1)
+    assert store.get("s", version=2) is None
+    assert store.version("s") == 1
+    assert store.get("s", version=1) == turn("m0")
+
+
+def test_set_is_conditional_on_the_version_read():
+    store = InMemoryHistoryStore()
+    store.set("s", turn("m0"), version=1)
+    assert store.set("s", turn("m0") + turn("A"), version=2, expected=1)
+    assert store.get("s", version=2) == turn("m0") + turn("A")
+
+
+def test_concurrent_turns_drop_the_entry_instead_of_losing_a_turn():
+    store = InMemoryHistoryStore()
+    store.set("s", turn("m0"), version=1)
+
+    # A reads at version 1; B starts after A bumped lastModified to 2, misses and reloads
+    read_a = store.version("s")
+    history_a = store.get("s", version=1)
+    read_b = store.version("s")
+    assert store.get("s", version=2) is None
+    history_b = turn("m0")
+
+    # A finishes first and is stored; B's history lacks A, so it is not
+    assert store.set("s", history_a + turn("A"), version=2, expected=read_a)
+    assert not store.set("s", history_b + turn("B"), version=3, expected=read_b)
+    assert store.get("s", version=3) is None
+    assert store.stats()["conflicts"] == 1
+
+
+def test_the_later_of_two_concurrent_turns_drops_the_earlier_ones_entry():
+    store = InMemoryHistoryStore()
+    store.set("s", turn("m0"), version=1)
+    read_a = store.version("s")
+    read_b = store.version("s")
+
+    assert store.set("s", turn("m0") + turn("B"), version=3, expected=read_b)
+    assert not store.set("s", turn("m0") + turn("A"), version=2, expected=read_a)
+    assert store.version("s") is None
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyStore
+
+
+class Generation:
+    """Counts runs and blocks each one until released"""
+
+    def __init__(self):
+        self.runs = 0
+        self.release = None
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        return f"reply {self.runs}"
+
+
+def test_identical_requests_in_flight_share_one_run():
+    async def main():
+        store = IdempotencyStore()
+        generate = Generation()
+        generate.release = asyncio.Event()
+        first = asyncio.create_task(store.run("u1", {"message": "hi"}, generate))
+        second = asyncio.create_task(store.run("u1", {"message": "hi"}, generate))
+        await asyncio.sleep(0)
+        generate.release.set()
+        assert await asyncio.gather(first, second) == ["reply 1", "reply 1"]
+        assert generate.runs == 1
+        assert store.stats()["coalesced"] == 1
+
+        # Without a key nothing is kept once the run is over
+        assert await store.run("u1", {"message": "hi"}, generate) == "reply 2"
+
+    asyncio.run(main())
+
+
+def test_a_retry_with_the_same_key_replays_the_reply():
+    async def main():
+        store = IdempotencyStore()
+        generate = Generation()
+        generate.release = asyncio.Event()
+        generate.release.set()
+        assert await store.run("u1", {"message": "hi"}, generate, key="k") == "reply 1"
+        assert await store.run("u1", {"message": "hi"}, generate, key="k") == "reply 1"
+        assert generate.runs == 1
+        assert store.stats()["replayed"] == 1
+
+        # Keys are scoped to the user
+        assert await store.run("u2", {"message": "hi"}, generate, key="k") == "reply 2"
+
+    asyncio.run(main())
+
+
+def test_reusing_a_key_with_another_body_is_rejected():
+    async def main():
+        store = IdempotencyStore()
+        generate = Generation()
+        generate.release = asyncio.Event()
+        running = asyncio.create_task(store.run("u1", {"message": "hi"}, generate, key="k"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as in_flight:
+            await store.run("u1", {"message": "other"}, generate, key="k")
+        generate.release.set()
+        await running
+        with pytest.raises(HTTPException) as completed:
+            await store.run("u1", {"message": "other"}, generate, key="k")
+        assert in_flight.value.status_code == completed.value.status_code == 422
+        assert generate.runs == 1
+
+    asyncio.run(main())
+
+
+def test_a_failure_is_not_remembered():
+    async def main():
+        store = IdempotencyStore()
+        calls = []
+
+        async def flaky():
+            calls.append(None)
+            if len(calls) == 1:
+                raise RuntimeError("upstream failed")
+            return "reply"
+
+        with pytest.raises(RuntimeError):
+            await store.run("u1", {"message": "hi"}, flaky, key="k")
+        assert await store.run("u1", {"message": "hi"}, flaky, key="k") == "reply"
+        assert len(calls) == 2
+        assert store.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_run():
+    async def main():
+        store = IdempotencyStore()
+        generate = Generation()
+        generate.release = asyncio.Event()
+        leaving = asyncio.create_task(store.run("u1", {"message": "hi"}, generate))
+        staying = asyncio.create_task(store.run("u1", {"message": "hi"}, generate))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.sleep(0)
+        generate.release.set()
+        assert await staying == "reply 1"
+        assert leaving.cancelled()
+
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from bson.int64 import Int64
+
+from metrics import MONGO_OPERATION_DURATION, MongoCommandMetrics
+
+
+def command(name: str, body: dict, request_id: int):
+    return SimpleNamespace(command_name=name, command=body, connection_id=("db", 27017),
+                           request_id=request_id, duration_micros=1500)
+
+
+def series(operation: str) -> list:
+    return [line for line in MONGO_OPERATION_DURATION.samples()
+            if line.startswith("mongo_operation_duration_seconds_count") and f'operation="{operation}"' in line]
+
+
+def test_commands_are_labelled_with_their_collection():
+    listener = MongoCommandMetrics()
+    find = command("find", {"find": "messages", "filter": {}}, 1)
+    listener.started(find)
+    listener.succeeded(find)
+    get_more = command("getMore", {"getMore": Int64(8123456789), "collection": "messages"}, 2)
+    listener.started(get_more)
+    listener.succeeded(get_more)
+
+    assert any('collection="messages"' in line for line in series("find"))
+    assert all('collection="messages"' in line for line in series("getMore"))
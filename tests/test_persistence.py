@@ -0,0 +1,83 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+
+from persistence import WriteBehindQueue
+
+
+class FakeCollection:
+    """Collection whose insert_many raises the queued errors first, then stores documents"""
+
+    name = "messages"
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.documents = {}
+        self.attempts = 0
+
+    async def insert_many(self, documents, ordered=True):
+        self.attempts += 1
+        if self.errors:
+            error = self.errors.pop(0)
+            if callable(error):
+                error = error(self, documents)
+            raise error
+        for document in documents:
+            self.documents[document["_id"]] = document
+
+
+def queue() -> WriteBehindQueue:
+    return WriteBehindQueue(flush_interval=0, max_attempts=3, retry_delay=0.001)
+
+
+async def write(collection, count: int = 2) -> WriteBehindQueue:
+    writes = queue()
+    for i in range(count):
+        await writes.insert(collection, {"_id": i})
+    await writes.flush()
+    await writes.stop()
+    return writes
+
+
+def test_transient_errors_are_retried_before_flush_returns():
+    collection = FakeCollection(AutoReconnect("primary stepped down"), AutoReconnect("no primary"))
+    writes = asyncio.run(write(collection))
+    assert sorted(collection.documents) == [0, 1]
+    assert collection.attempts == 3
+    assert writes.stats()["written"] == 2
+    assert writes.stats()["retries"] == 2
+    assert writes.stats()["failed"] == 0
+
+
+def test_documents_are_dropped_once_attempts_are_used_up():
+    collection = FakeCollection(*[AutoReconnect("down")] * 3)
+    writes = asyncio.run(write(collection))
+    assert collection.documents == {}
+    assert collection.attempts == 3
+    assert writes.stats()["failed"] == 2
+
+
+def test_permanent_errors_are_not_retried():
+    collection = FakeCollection(OperationFailure("Document failed validation", code=121))
+    writes = asyncio.run(write(collection))
+    assert collection.attempts == 1
+    assert writes.stats()["failed"] == 2
+
+
+def test_retry_after_a_lost_reply_counts_duplicates_as_written():
+    def inserted_then_lost(collection, documents):
+        for document in documents:
+            collection.documents[document["_id"]] = document
+        return AutoReconnect("connection reset")
+
+    def duplicates(collection, documents):
+        return BulkWriteError({
+            "writeErrors": [{"index": i, "code": 11000, "errmsg": "duplicate key"} for i in range(len(documents))],
+            "nInserted": 0,
+        })
+
+    collection = FakeCollection(inserted_then_lost, duplicates)
+    writes = asyncio.run(write(collection))
+    assert sorted(collection.documents) == [0, 1]
+    assert writes.stats()["written"] == 2
+    assert writes.stats()["failed"] == 0
@@ -0,0 +1,39 @@
+from ratelimit import AdmissionControlMiddleware, InMemoryRateLimiter, LoadShedder, route_group
+
+
+def middleware(proxy_hops: int) -> AdmissionControlMiddleware:
+    return AdmissionControlMiddleware(None, InMemoryRateLimiter(), LoadShedder(), limits={}, proxy_hops=proxy_hops)
+
+
+def scope(*forwarded: bytes) -> dict:
+    return {"headers": [(b"x-forwarded-for", value) for value in forwarded], "client": ("10.0.0.2", 5000)}
+
+
+def test_forwarded_for_is_ignored_without_proxy_hops():
+    assert middleware(0)._client_ip(scope(b"1.2.3.4")) == "10.0.0.2"
+
+
+def test_client_is_the_entry_added_by_the_outermost_proxy():
+    # The client sent a forged entry; two trusted proxies appended theirs
+    forwarded = scope(b"6.6.6.6, 203.0.113.7, 10.0.0.1")
+    assert middleware(2)._client_ip(forwarded) == "203.0.113.7"
+    assert middleware(1)._client_ip(forwarded) == "10.0.0.1"
+
+
+def test_separate_forwarded_headers_count_as_hops():
+    assert middleware(2)._client_ip(scope(b"6.6.6.6, 203.0.113.7", b"10.0.0.1")) == "203.0.113.7"
+
+
+def test_missing_hops_fall_back_to_the_peer():
+    assert middleware(2)._client_ip(scope(b"203.0.113.7")) == "10.0.0.2"
+    assert middleware(1)._client_ip(scope()) == "10.0.0.2"
+
+
+def test_only_sends_are_in_the_chat_group():
+    assert route_group("POST", "/api/chat/message") == "chat"
+    assert route_group("POST", "/api/chat/message/stream") == "chat"
+    assert route_group("GET", "/api/chat/search") == "crud"
+    assert route_group("GET", "/api/chat/conversations") == "crud"
+    assert route_group("GET", "/api/chat/conversations/abc/messages") == "crud"
+    assert route_group("POST", "/api/auth/login") == "auth"
+    assert route_group("GET", "/health") is None
@@ -0,0 +1,137 @@
+import asyncio
+
+import anthropic
+import httpx
+import pytest
+
+from resilience import AIServiceError, CircuitBreaker, RetryPolicy, call_with_resilience
+
+
+def status_error(status_code: int) -> anthropic.APIStatusError:
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    return anthropic.APIStatusError("upstream", response=httpx.Response(status_code, request=request), body=None)
+
+
+def fast_policy(**overrides) -> RetryPolicy:
+    options = {"attempt_timeout": 1, "deadline": 5, "max_retries": 2, "base_delay": 0, "max_delay": 0}
+    options.update(overrides)
+    return RetryPolicy(**options)
+
+
+def failing(*errors):
+    """A call raising `errors` in turn, then returning "ok" """
+    remaining = list(errors)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if remaining:
+            raise remaining.pop(0)
+        return "ok"
+
+    return call, calls
+
+
+def open_breaker(reset_timeout: float = 0) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=reset_timeout)
+    breaker.before_call()
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(AIServiceError) as error:
+        breaker.before_call()
+    assert error.value.status_code == 503
+    assert error.value.retry_after > 0
+    assert breaker.rejected == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = open_breaker()
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+    with pytest.raises(AIServiceError):
+        breaker.before_call()
+
+
+def test_probe_success_closes_and_failure_reopens():
+    breaker = open_breaker()
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+    breaker = open_breaker(reset_timeout=60)
+    breaker.opened_at -= 60
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_non_retryable_probe_releases_the_slot():
+    breaker = open_breaker()
+    call, _ = failing(status_error(400))
+    with pytest.raises(AIServiceError) as error:
+        asyncio.run(call_with_resilience(call, fast_policy(), breaker))
+    assert error.value.status_code == 502
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+
+
+def test_cancelled_probe_releases_the_slot():
+    breaker = open_breaker()
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def run():
+        task = asyncio.create_task(call_with_resilience(hang, fast_policy(attempt_timeout=60), breaker))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert breaker.before_call() is True
+
+
+def test_retryable_errors_are_retried():
+    breaker = CircuitBreaker(failure_threshold=5)
+    policy = fast_policy()
+    call, calls = failing(status_error(529), status_error(503))
+    assert asyncio.run(call_with_resilience(call, policy, breaker)) == "ok"
+    assert len(calls) == 3
+    assert policy.retries == 2
+    assert breaker.failures == 0
+
+
+def test_retries_stop_at_max_retries():
+    breaker = CircuitBreaker(failure_threshold=10)
+    call, calls = failing(*[status_error(500)] * 5)
+    with pytest.raises(AIServiceError) as error:
+        asyncio.run(call_with_resilience(call, fast_policy(max_retries=2), breaker))
+    assert error.value.status_code == 503
+    assert len(calls) == 3
+
+
+def test_client_errors_are_not_retried_or_counted():
+    breaker = CircuitBreaker(failure_threshold=1)
+    call, calls = failing(status_error(400))
+    with pytest.raises(AIServiceError):
+        asyncio.run(call_with_resilience(call, fast_policy(), breaker))
+    assert len(calls) == 1
+    assert breaker.state == "closed"
+
+
+def test_attempt_timeout_maps_to_504():
+    async def hang():
+        await asyncio.sleep(60)
+
+    with pytest.raises(AIServiceError) as error:
+        asyncio.run(call_with_resilience(hang, fast_policy(attempt_timeout=0.01, max_retries=0), CircuitBreaker()))
+    assert error.value.status_code == 504
@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+from response_cache import InMemoryResponseCache, MongoResponseCache
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length):
+        return [{"_id": doc["_id"]} for doc in self.docs[:length]]
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, query, update, upsert=False):
+        self.docs.setdefault(query["_id"], {"_id": query["_id"]}).update(update["$set"])
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+    def find(self, query, projection=None):
+        return FakeCursor(list(self.docs.values()))
+
+    async def delete_many(self, query):
+        ids = query["_id"]["$in"]
+        for key in ids:
+            del self.docs[key]
+        return SimpleNamespace(deleted_count=len(ids))
+
+
+def test_mongo_cache_trims_the_entries_closest_to_expiry():
+    collection = FakeCollection()
+    cache = MongoResponseCache(collection, ttl_seconds=60, max_entries=3)
+
+    async def run():
+        for key in "abcde":
+            await cache.set(key, f"reply {key}")
+            await asyncio.sleep(0.001)
+
+    asyncio.run(run())
+    assert sorted(collection.docs) == ["c", "d", "e"]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = InMemoryResponseCache(max_entries=2)
+
+    async def run():
+        await cache.set("a", "1")
+        await cache.set("b", "2")
+        await cache.get("a")
+        await cache.set("c", "3")
+        return await cache.get("a"), await cache.get("b")
+
+    assert asyncio.run(run()) == ("1", None)
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from scheduler import FairScheduler, SchedulerTimeout
+
+
+def test_free_slots_go_round_robin_between_keys():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1, queue_timeout=5)
+        order = []
+
+        async def call(key, name):
+            async with scheduler.slot(key):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        holder = asyncio.create_task(call("a", "a1"))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(call(key, name)) for key, name in [("a", "a2"), ("a", "a3"), ("b", "b1")]]
+        await asyncio.gather(holder, *waiting)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ["a1", "a2", "b1", "a3"]
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+
+
+def test_waiting_past_the_queue_timeout_raises():
+    async def run():
+        scheduler = FairScheduler(max_concurrency=1, queue_timeout=0.01)
+        await scheduler.acquire("a")
+        with pytest.raises(SchedulerTimeout):
+            await scheduler.acquire("b")
+        assert scheduler.stats()["queue_depth"] == 0
+        scheduler.release()
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0
+    assert stats["timeouts"] == 1
+
+
+def test_slot_handed_over_as_the_wait_times_out_is_released(monkeypatch):
+    scheduler = FairScheduler(max_concurrency=1, queue_timeout=5)
+
+    async def hand_over_then_time_out(waiter, timeout):
+        # release() grants the slot, then the timeout fires anyway
+        scheduler.release()
+        raise asyncio.TimeoutError
+
+    async def run():
+        await scheduler.acquire("a")
+        with monkeypatch.context() as patch:
+            patch.setattr(asyncio, "wait_for", hand_over_then_time_out)
+            with pytest.raises(SchedulerTimeout):
+                await scheduler.acquire("b")
+        # The holder's slot went to the timed-out waiter, which gave it back
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
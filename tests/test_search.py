@@ -0,0 +1,160 @@
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from search import InMemorySearchIndex, _UserIndex, query_terms, snippet
+
+
+class FakeCursor:
+    def __init__(self, docs, gate=None):
+        self.docs = docs
+        self.gate = gate
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+    async def __aiter__(self):
+        for doc in list(self.docs):
+            if self.gate is not None:
+                await self.gate()
+            yield doc
+
+
+class FakeCollection:
+    """find() with equality and $in filters; `gate` is awaited before each streamed document"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.finds = 0
+        self.gate = None
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        matched = [
+            doc for doc in self.docs
+            if all(doc.get(key) in condition["$in"] if isinstance(condition, dict) else doc.get(key) == condition
+                   for key, condition in query.items())
+        ]
+        return FakeCursor(matched, self.gate)
+
+
+USER = ObjectId()
+
+
+def conversation(title: str) -> dict:
+    return {"_id": ObjectId(), "userId": USER, "title": title, "createdAt": datetime(2024, 1, 1)}
+
+
+def message(conv: dict, content: str) -> dict:
+    return {"_id": ObjectId(), "conversationId": conv["_id"], "userId": USER, "role": "user",
+            "content": content, "timestamp": datetime(2024, 1, 2)}
+
+
+def test_query_terms_drop_negations_and_quotes():
+    assert query_terms('"mongo index" -slow Deploy') == ["mongo", "index", "deploy"]
+
+
+def test_snippet_centres_on_the_first_match_with_ellipses():
+    text = "filler " * 40 + "the Kubernetes deployment failed " + "tail " * 40
+    cut = snippet(text, ["kubernetes"], length=60)
+    assert cut.startswith("…") and cut.endswith("…")
+    assert "Kubernetes" in cut
+    assert len(cut) <= 62
+    assert snippet("short  text\nhere", ["x"]) == "short text here"
+    assert snippet("word " * 100, [], length=20).startswith("word")
+
+
+def test_bm25_ranks_rarer_and_more_frequent_terms_higher():
+    index = _UserIndex()
+    docs = {name: {"_id": ObjectId()} for name in ("both", "common", "rare", "rare_twice")}
+    index.add("message", docs["both"], None, "deploy the docker image")
+    index.add("message", docs["common"], None, "deploy again")
+    index.add("message", docs["rare"], None, "docker build")
+    index.add("message", docs["rare_twice"], None, "docker docker")
+    for _ in range(4):
+        index.add("message", {"_id": ObjectId()}, None, "deploy now")
+    ranked = [doc_id for doc_id, _ in index.rank(["docker", "deploy"])]
+    position = {name: ranked.index(doc["_id"]) for name, doc in docs.items()}
+    # "docker" is in 3 of 8 documents, "deploy" in 6: the rarer term weighs more
+    assert position["rare_twice"] < position["rare"] < position["common"]
+    assert position["both"] < position["common"]
+    assert len(ranked) == 8
+    assert index.rank(["missing"]) == []
+
+
+def test_offset_paging_walks_the_ranking_without_overlap():
+    conv = conversation("notes")
+    messages = [message(conv, f"mongo topic {i}" + " filler" * i) for i in range(5)]
+    index = InMemorySearchIndex(FakeCollection([conv]), FakeCollection(messages))
+
+    async def main():
+        first, more = await index.search(str(USER), "mongo", limit=2)
+        second, _ = await index.search(str(USER), "mongo", limit=2, offset=2)
+        last, no_more = await index.search(str(USER), "mongo", limit=2, offset=4)
+        return first, more, second, last, no_more
+
+    first, more, second, last, no_more = asyncio.run(main())
+    ids = [hit["messageId"] for hit in first + second + last]
+    assert more and not no_more
+    assert len(ids) == len(set(ids)) == 5
+    scores = [hit["score"] for hit in first + second + last]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_writes_during_a_build_are_indexed_once_and_concurrent_searches_share_it():
+    conv = conversation("deploy plans")
+    stored = message(conv, "deploy with docker")
+    messages = FakeCollection([stored])
+    conversations = FakeCollection([conv])
+    index = InMemorySearchIndex(conversations, messages)
+    written = message(conv, "deploy to staging")
+
+    async def main():
+        async def write_meanwhile():
+            # A message written after the build started only arrives
+            # through the write hook; one the build also reads is added once
+            index.add_messages([written, stored])
+            await asyncio.sleep(0)
+
+        messages.gate = write_meanwhile
+        first = asyncio.create_task(index.search(str(USER), "deploy", limit=10))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(index.search(str(USER), "deploy", limit=10))
+        return await first, await second
+
+    (first, _), (second, _) = asyncio.run(main())
+    assert index.builds == 1 and conversations.finds == 1
+    assert sorted(hit["snippet"] for hit in first) == ["deploy plans", "deploy to staging", "deploy with docker"]
+    assert first == second
+
+
+def test_a_search_waiting_on_a_failed_build_starts_another():
+    conv = conversation("deploy plans")
+    conversations = FakeCollection([conv])
+    messages = FakeCollection([message(conv, "deploy now")])
+    index = InMemorySearchIndex(conversations, messages)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fail_once():
+            messages.gate = None
+            await release.wait()
+            raise ConnectionError("mongo went away")
+
+        messages.gate = fail_once
+        failing = asyncio.create_task(index.search(str(USER), "deploy", limit=10))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(index.search(str(USER), "deploy", limit=10))
+        await asyncio.sleep(0)
+        release.set()
+        try:
+            await failing
+        except ConnectionError:
+            pass
+        return await waiting
+
+    hits, _ = asyncio.run(main())
+    assert len(hits) == 2
+    assert index.builds == 1
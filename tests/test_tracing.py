@@ -0,0 +1,63 @@
+import asyncio
+
+from tracing import TracingMiddleware, span
+
+
+class RecordingProfiler:
+    def __init__(self):
+        self.calls = []
+
+    def start(self):
+        pass
+
+    def maybe_dump(self, method, route, status, started, ended, trace):
+        self.calls.append((status, ended - started, trace.breakdown()))
+
+
+async def streamed_app(scope, receive, send):
+    with span("mongo"):
+        await asyncio.sleep(0.01)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    # A slow client or upstream paces the body
+    await asyncio.sleep(0.3)
+    await send({"type": "http.response.body", "body": b"done"})
+
+
+def run(app, profiler):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/api/export", "headers": []}
+    asyncio.run(TracingMiddleware(app, profiler)(scope, receive, send))
+    return sent
+
+
+def test_profiler_times_a_streamed_request_until_the_response_starts():
+    profiler = RecordingProfiler()
+    sent = run(streamed_app, profiler)
+
+    [(status, duration, spans)] = profiler.calls
+    assert status == 200
+    assert duration < 0.2
+    assert spans["mongo"]["calls"] == 1
+    assert any(name == b"server-timing" for name, _ in sent[0]["headers"])
+
+
+def test_profiler_times_a_request_that_never_responds_until_it_ends():
+    async def failing_app(scope, receive, send):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("boom")
+
+    profiler = RecordingProfiler()
+    try:
+        run(failing_app, profiler)
+    except RuntimeError:
+        pass
+    [(status, duration, _)] = profiler.calls
+    assert status == 500
+    assert duration >= 0.05